@@ -54,9 +54,19 @@ def main():
         "nkod-description.udpipe-f.reduce.word2vec[labels.160.40.d].vector.cosine",
         "nkod-description.udpipe-f.reduce.hausdorff[labels.80.40.d]",
         "nkod-wikidata-concepts-d.concat.reduce.word2vec[concepts.80.40.d].vector.cosine",
-        "nkod-wikidata-concepts.concat.reduce.word2vec[concepts.40.10.d].vector.cosine"
+        "nkod-wikidata-concepts.concat.reduce.word2vec[concepts.40.10.d].vector.cosine",
+        # odin-backend/compute_graph_similarity_matrix.py, skipped when
+        # the matrix was not computed.
+        "nkod-wikidata-mapping.graph.closest[3].average",
     ]
     for name in names:
+        similarity_file = \
+            "../data/similarities-matrix/nkod-20/" + name + ".csv"
+        if not os.path.exists(similarity_file):
+            # Some matrices, e.g. the graph similarity, take hours to
+            # compute, so they are optional.
+            print("Skipping missing", similarity_file)
+            continue
         convert(
             # Translation from IRI to file name.
             "../data/dataset-iri-to-file-name.json",
@@ -64,7 +74,7 @@ def main():
             # that this defined order of records in the matrix.
             "../data/similarities-matrix/nkod-20-title.csv",
             # The similarity matrix.
-            "../data/similarities-matrix/nkod-20/" + name + ".csv",
+            similarity_file,
             # Output path.
             "../data/similarities/" + name + "/"
         )
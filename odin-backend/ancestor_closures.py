@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Ancestors of hierarchy graph nodes with their minimal distance. With
+# closures of mapped entities the meeting of two entities is given by
+# intersection of their closures, no graph search is needed.
+#
+# Closures of the shared graph are computed at the service startup for
+# entities of all datasets, closures of other graphs on first use.
+#
+
+import array
+import weakref
+import typing
+
+from hierarchy_graph import HierarchyGraph, breadth_first_search
+
+# Closures of graphs, they are released together with the graph.
+_graph_closures = weakref.WeakKeyDictionary()
+
+
+class AncestorClosure:
+    """
+    Nodes reachable from a node, including the node itself, ordered by
+    the minimal distance. Nodes with distance d are stored in
+    nodes[offsets[d]:offsets[d + 1]]. Parent of a node is the smallest
+    node in the previous level with an edge to the node, -1 for the
+    first node.
+    """
+
+    __slots__ = ("nodes", "offsets", "parents")
+
+    def __init__(
+            self, nodes: array.array, offsets: array.array,
+            parents: array.array):
+        self.nodes = nodes
+        self.offsets = offsets
+        self.parents = parents
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def depth(self) -> int:
+        """Return the biggest distance."""
+        return len(self.offsets) - 2
+
+    def level(self, distance: int) -> typing.Sequence[int]:
+        """Return nodes with given distance."""
+        if distance > self.depth():
+            return ()
+        return self.nodes[self.offsets[distance]:self.offsets[distance + 1]]
+
+    def parent_map(self) -> typing.Dict[int, int]:
+        return dict(zip(self.nodes, self.parents))
+
+    def distances(self) -> typing.Dict[int, int]:
+        return {
+            node: distance
+            for distance in range(self.depth() + 1)
+            for node in self.level(distance)
+        }
+
+    def within(self, max_distance: int = None) -> typing.List[frozenset]:
+        """
+        Return sets of nodes with distance at most 0, 1, ... up to the
+        given distance or the depth.
+        """
+        depth = self.depth()
+        if max_distance is not None:
+            depth = min(depth, max_distance)
+        result = []
+        nodes = set()
+        for distance in range(depth + 1):
+            nodes.update(self.level(distance))
+            result.append(frozenset(nodes))
+        return result
+
+
+class AncestorClosures:
+    """Closures of nodes of a graph, computed on first use."""
+
+    def __init__(self, graph: HierarchyGraph):
+        # Do not keep the graph alive from the graph closures dictionary.
+        self._graph = weakref.ref(graph)
+        self._closures: typing.Dict[int, AncestorClosure] = {}
+
+    def __len__(self):
+        return len(self._closures)
+
+    def get(self, node: int) -> AncestorClosure:
+        closure = self._closures.get(node)
+        if closure is None:
+            closure = self._compute(node)
+            self._closures[node] = closure
+        return closure
+
+    def compute_datasets(self):
+        """Compute closures of entities of all datasets of the graph."""
+        for entities in self._graph().datasets.values():
+            for entity in entities:
+                self.get(entity)
+
+    def _compute(self, node: int) -> AncestorClosure:
+        return AncestorClosure(
+            *breadth_first_search([node], self._graph().get))
+
+    def statistics(self) -> typing.Dict[str, int]:
+        return {
+            "nodes": len(self._closures),
+            "ancestors": sum(len(item) for item in self._closures.values()),
+        }
+
+
+def get_ancestor_closures(graph: HierarchyGraph) -> AncestorClosures:
+    if graph not in _graph_closures:
+        _graph_closures[graph] = AncestorClosures(graph)
+    return _graph_closures[graph]
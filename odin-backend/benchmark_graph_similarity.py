@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Benchmark of graph similarity computation stages.
+#
+# Runs every scenario, synthetic or based on real mapping files, and
+# measures duration of the stages. Results are compared with a baseline
+# file, stages slower than the baseline by more than the threshold are
+# reported as regressions and the script exits with non-zero code.
+#
+# Usage:
+#   python benchmark_graph_similarity.py            compare with baseline
+#   python benchmark_graph_similarity.py --save     store new baseline
+#
+# For the landmark method we also report relative error of the estimated
+# average, ratio of entities resolved by the exact search and speedup
+# against the exact summary.
+#
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+import typing
+from dataclasses import dataclass, field
+
+from compute_graph_similarity import \
+    Dataset, Mapping, MappingItem, HierarchyEntry, Hierarchy, \
+    create_search_options, path_engines, prepare_graph, search_graph_paths, \
+    select_closest_for_each, paths_to_output, default_vocabulary, \
+    estimate_closest, lengths_to_similarity, select_lengths, \
+    _load_dataset_from_file
+from landmark_index import LandmarkIndex
+
+DEFAULT_BASELINE = "../data/benchmark/graph-similarity-baseline.json"
+
+REAL_MAPPING_DIRECTORY = "../data/mapping/v1"
+
+# Regressions smaller than this are considered to be noise, in seconds.
+NOISE_FLOOR = 0.002
+
+LANDMARK_COUNT = 16
+
+LANDMARK_TOLERANCES = [0, 2, 4]
+
+
+@dataclass
+class SyntheticScenario:
+    name: str
+    """Number of levels below the root."""
+    depth: int
+    """Number of nodes in each level."""
+    width: int
+    """Number of parents of each node."""
+    branching: int
+    """Number of mapped entities in each dataset."""
+    mapping_size: int
+    """Generic nodes every node is connected to with given probability."""
+    hub_count: int = 0
+    hub_probability: float = 0
+    options: typing.Dict = field(default_factory=lambda: {"distance": 3})
+    """Engines to run, all available if None."""
+    engines: typing.Optional[typing.List[str]] = None
+    seed: int = 0
+
+
+@dataclass
+class RealScenario:
+    name: str
+    left: str
+    right: str
+    options: typing.Dict = field(default_factory=lambda: {"distance": 3})
+    engines: typing.Optional[typing.List[str]] = None
+
+
+SCENARIOS = [
+    SyntheticScenario("small", 6, 200, 2, 20),
+    SyntheticScenario("medium", 10, 1000, 2, 100),
+    SyntheticScenario("deep", 24, 300, 2, 50),
+    SyntheticScenario("wide-branching", 8, 1000, 4, 100),
+    SyntheticScenario("hubs", 8, 1000, 2, 100, 5, 0.5),
+    SyntheticScenario(
+        "hubs-capped", 8, 1000, 2, 100, 5, 0.5,
+        options={"distance": 3, "maxHubDegree": 100}),
+    SyntheticScenario("no-distance", 10, 1000, 2, 100, options={}),
+    SyntheticScenario(
+        "large-mapping", 10, 3000, 2, 400,
+        engines=["multi-source", "sparse"]),
+    RealScenario("real-000005-000049", "000005", "000049"),
+    RealScenario("real-000001-000005", "000001", "000005"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--save", action="store_true", help="Store results as baseline.")
+    parser.add_argument(
+        "--threshold", type=float, default=0.2,
+        help="Relative slowdown reported as regression.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--scenario", action="append", help="Run only given scenarios.")
+    arguments = parser.parse_args()
+
+    results = {}
+    for scenario in SCENARIOS:
+        if arguments.scenario and scenario.name not in arguments.scenario:
+            continue
+        datasets = create_datasets(scenario)
+        if datasets is None:
+            print("Skipping", scenario.name, "missing mapping files.")
+            continue
+        print("Running", scenario.name, "...")
+        results[scenario.name] = run_scenario(
+            scenario, *datasets, arguments.repeat)
+
+    if arguments.save:
+        os.makedirs(os.path.dirname(arguments.baseline), exist_ok=True)
+        with open(arguments.baseline, "w", encoding="utf-8") as stream:
+            json.dump(results, stream, indent=2)
+        print_results(results, {}, arguments.threshold)
+        return 0
+
+    baseline = {}
+    if os.path.exists(arguments.baseline):
+        with open(arguments.baseline, encoding="utf-8") as stream:
+            baseline = json.load(stream)
+    regressions = print_results(results, baseline, arguments.threshold)
+    return 1 if regressions else 0
+
+
+# region Datasets
+
+def create_datasets(scenario) \
+        -> typing.Optional[typing.Tuple[Dataset, Dataset]]:
+    if isinstance(scenario, RealScenario):
+        paths = [
+            os.path.join(REAL_MAPPING_DIRECTORY, name + ".json")
+            for name in [scenario.left, scenario.right]
+        ]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        return _load_dataset_from_file(paths[0]), \
+               _load_dataset_from_file(paths[1])
+    generator = random.Random(scenario.seed)
+    parents = generate_hierarchy(generator, scenario)
+    # Map mostly to the lower half of the hierarchy.
+    candidates = [
+        node for node in parents.keys()
+        if _node_level(node) > scenario.depth / 2
+    ]
+    return tuple(
+        create_dataset(
+            "synthetic:{}:{}".format(scenario.name, index), parents,
+            generator.sample(candidates, scenario.mapping_size))
+        for index in range(2)
+    )
+
+
+def generate_hierarchy(
+        generator: random.Random, scenario: SyntheticScenario) \
+        -> typing.Dict[str, typing.List[str]]:
+    """Return parents for each node, node IDs are 'L<level>N<index>'."""
+    parents = {"L0N0": []}
+    hubs = ["L1N{}".format(index) for index in range(scenario.hub_count)]
+    previous_level = ["L0N0"]
+    for level in range(1, scenario.depth + 1):
+        current_level = []
+        for index in range(scenario.width):
+            node = "L{}N{}".format(level, index)
+            node_parents = generator.sample(
+                previous_level, min(scenario.branching, len(previous_level)))
+            if level > 1 and generator.random() < scenario.hub_probability:
+                node_parents.append(generator.choice(hubs))
+            parents[node] = node_parents
+            current_level.append(node)
+        previous_level = current_level
+    return parents
+
+
+def _node_level(node: str) -> int:
+    return int(node[1:node.index("N")])
+
+
+def create_dataset(
+        iri: str, parents: typing.Dict[str, typing.List[str]],
+        entities: typing.List[str]) -> Dataset:
+    hierarchy = set()
+    visited = set(entities)
+    to_visit = list(entities)
+    while to_visit:
+        node = to_visit.pop()
+        for parent in parents[node]:
+            hierarchy.add(HierarchyEntry(node, "subclassof", parent))
+            if parent not in visited:
+                visited.add(parent)
+                to_visit.append(parent)
+    mapping = Mapping("title", {"from": "title"}, [
+        MappingItem(default_vocabulary.intern(entity), {})
+        for entity in entities
+    ])
+    return Dataset(iri, [mapping], Hierarchy.from_entries(sorted(hierarchy)))
+
+
+# endregion
+
+# region Measurement
+
+def run_scenario(
+        scenario, left: Dataset, right: Dataset, repeat: int) \
+        -> typing.Dict[str, float]:
+    """Return minimal duration of each stage in seconds."""
+    engines = [
+        engine for engine in scenario.engines or path_engines.keys()
+        # The sparse engine requires optional dependencies.
+        if engine in path_engines
+    ]
+    durations = {}
+
+    def measure(name: str, function: typing.Callable):
+        times = []
+        result = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            times.append(time.perf_counter() - start)
+        durations[name] = min(times)
+        durations[name + ":median"] = statistics.median(times)
+        return result
+
+    graph, *entries = measure("graph", lambda: prepare_graph(left, right))
+    paths = None
+    for engine in engines:
+        search_options = create_search_options(
+            {**scenario.options, "engine": engine})
+        search = measure(
+            "search[{}]".format(engine),
+            lambda: search_graph_paths(graph, *entries, search_options))
+        paths = search.paths if paths is None else paths
+    summary_options = create_search_options(
+        {**scenario.options, "summaryOnly": True})
+    measure("summary_only", lambda: select_lengths(
+        search_graph_paths(graph, *entries, summary_options).path_lengths,
+        scenario.options))
+    selected = measure(
+        "select_closest_for_each",
+        lambda: select_closest_for_each(paths, scenario.options))
+    measure(
+        "paths_to_output",
+        lambda: json.dumps(paths_to_output(selected, [left, right])))
+    durations["pathCount"] = len(paths)
+
+    index = measure(
+        "landmark_index", lambda: LandmarkIndex.build(
+            graph, LANDMARK_COUNT, [*entries[0], *entries[1]]))
+    exact = lengths_to_similarity(
+        closest_lengths(paths, scenario.options.get("distance")))
+    for tolerance in LANDMARK_TOLERANCES:
+        name = "[tolerance={}]".format(tolerance)
+        options = {**scenario.options, "tolerance": tolerance}
+        estimate = measure(
+            "estimate" + name,
+            lambda: estimate_closest(graph, index, *entries, options))
+        error = 0
+        if exact:
+            error = abs(
+                estimate.similarity.get("average", 0) - exact["average"]) \
+                    / exact["average"] if exact["average"] else 0
+        durations["landmark:error" + name] = error
+        durations["landmark:searched" + name] = \
+            estimate.searched / (len(entries[0]) + len(entries[1]))
+        durations["landmark:speedup" + name] = \
+            durations["summary_only"] / durations["estimate" + name] \
+            if durations["estimate" + name] else 0
+    return durations
+
+
+def closest_lengths(
+        paths, max_distance: typing.Optional[int]) -> typing.List[int]:
+    """Return length of the shortest path of each entity."""
+    shortest = {}
+    for path in paths:
+        length = max(len(path.nodes) - 2, 0)
+        for key in [("left", path.nodes[0]), ("right", path.nodes[-1])]:
+            shortest[key] = min(shortest.get(key, length), length)
+    return [
+        length for length in shortest.values()
+        if max_distance is None or length <= max_distance
+    ]
+
+
+def print_results(
+        results: typing.Dict[str, typing.Dict[str, float]],
+        baseline: typing.Dict[str, typing.Dict[str, float]],
+        threshold: float) -> int:
+    """Print results and return number of regressions."""
+    regressions = 0
+    print()
+    print("{:<24} {:<28} {:>10} {:>10} {:>8}".format(
+        "scenario", "stage", "seconds", "baseline", "change"))
+    for scenario, durations in results.items():
+        for stage, value in durations.items():
+            if stage.endswith(":median") or stage == "pathCount" \
+                    or stage.startswith("landmark:"):
+                continue
+            reference = baseline.get(scenario, {}).get(stage)
+            if reference is None:
+                print("{:<24} {:<28} {:>10.4f} {:>10} {:>8}".format(
+                    scenario, stage, value, "-", "-"))
+                continue
+            change = (value - reference) / reference if reference else 0
+            regression = change > threshold \
+                         and value - reference > NOISE_FLOOR
+            regressions += regression
+            print("{:<24} {:<28} {:>10.4f} {:>10.4f} {:>+7.0%}{}".format(
+                scenario, stage, value, reference, change,
+                " REGRESSION" if regression else ""))
+    print()
+    print("{:<24} {:<28} {:>10} {:>10} {:>8}".format(
+        "scenario", "landmark estimate", "error", "searched", "speedup"))
+    for scenario, durations in results.items():
+        for tolerance in LANDMARK_TOLERANCES:
+            name = "[tolerance={}]".format(tolerance)
+            if "landmark:error" + name not in durations:
+                continue
+            print("{:<24} {:<28} {:>10.2%} {:>10.2%} {:>7.1f}x".format(
+                scenario, "tolerance=" + str(tolerance),
+                durations["landmark:error" + name],
+                durations["landmark:searched" + name],
+                durations["landmark:speedup" + name]))
+    print()
+    print("Regressions:", regressions)
+    return regressions
+
+
+# endregion
+
+if __name__ == "__main__":
+    sys.exit(main())
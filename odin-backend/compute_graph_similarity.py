@@ -2,23 +2,44 @@
 # -*- coding: utf-8 -*-
 
 from collections import namedtuple, defaultdict
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 import typing
 import json
+import math
+import time
+import weakref
 import itertools
 
+try:
+    import numpy
+    import scipy.sparse
+except ImportError:
+    # The sparse engine is not available.
+    numpy = None
+    scipy = None
+
+from hierarchy_graph import HierarchyGraph, Hierarchy
+from vocabulary import Vocabulary, default_vocabulary
+from ancestor_closures import AncestorClosure, get_ancestor_closures
+from landmark_index import LandmarkIndex
+
 HierarchyEntry = namedtuple("hierarchy", ["source", "type", "target"])
 
+# Entities and nodes are vocabulary IDs, they are converted back to
+# Wikidata IDs by paths_to_output.
+
 
 @dataclass
 class MappingItem:
-    entity: str
+    __slots__ = ("entity", "metadata")
+    entity: int
     metadata: object
 
 
 @dataclass
 class Mapping:
+    __slots__ = ("id", "metadata", "data")
     id: str
     metadata: object
     data: typing.List[MappingItem]
@@ -26,28 +47,94 @@ class Mapping:
 
 @dataclass
 class Dataset:
+    __slots__ = ("id", "mappings", "hierarchy")
     id: str
     mappings: typing.List[Mapping]
-    hierarchy: typing.List[HierarchyEntry]
-
-
-AdjacencyList = typing.Dict[str, typing.Set[str]]
+    hierarchy: Hierarchy
 
 
 @dataclass
 class Path:
+    __slots__ = ("shared", "nodes")
     """Node int he middle of the path."""
-    shared: str
+    shared: int
     """Path with start/end and the start and end respectively."""
-    nodes: typing.Tuple[str]
+    nodes: typing.Tuple[int]
 
     def __hash__(self):
-        return hash(self.shared) + hash(self.nodes)
+        # The shared node is one of the nodes.
+        return hash(self.nodes)
 
     def __eq__(self, other):
         return self.shared == other.shared and self.nodes == other.nodes
 
 
+@dataclass
+class PathSearchOptions:
+    engine: str = "multi-source"
+    """Do not search further than given level, None for no limit."""
+    max_level: typing.Optional[int] = None
+    """Return all shortest paths through each shared node, not just one."""
+    all_shortest: bool = False
+    """Do not enter nodes with more incoming edges, None for no limit."""
+    max_hub_degree: typing.Optional[int] = None
+    """
+    Incoming edges by vocabulary ID used by max_hub_degree, -1 for
+    missing vocabulary IDs, see HierarchyGraph.entity_in_degrees. Nodes
+    without a degree in the table use degree in the searched graph.
+    """
+    hub_degrees: typing.Optional[typing.Sequence[int]] = None
+    """Stop the search at this time.monotonic() value, None for no limit."""
+    deadline: typing.Optional[float] = None
+    """
+    Collect path_lengths instead of paths, requires all_shortest to be
+    false.
+    """
+    summary_only: bool = False
+
+
+@dataclass
+class PathSearchResult:
+    paths: typing.List[Path]
+    """True if the search was stopped by a limit with nodes left to expand."""
+    truncated: bool = False
+    """Nodes not entered because of max_hub_degree."""
+    cut_hubs: typing.Set[int] = field(default_factory=set)
+    """True if the search was stopped by the deadline."""
+    partial: bool = False
+    """Number of levels searched for all entities, set for partial results."""
+    searched_levels: typing.Optional[int] = None
+    """
+    Number of pairs searched to the end, set for partial results of
+    engines searching pairs of entities instead of levels.
+    """
+    searched_pairs: typing.Optional[int] = None
+    """
+    With summary_only tuples (left entity, right entity, shared node,
+    number of nodes) describing the paths, in the order of paths. Nodes
+    are graph node IDs.
+    """
+    path_lengths: typing.List[typing.Tuple[int, int, int, int]] = \
+        field(default_factory=list)
+
+
+# Number of nodes expanded between deadline checks.
+DEADLINE_CHECK_INTERVAL = 256
+
+
+class _DeadlineExpired(Exception):
+    """Raised by a search when the deadline of the search options passed."""
+
+
+def _deadline_passed(deadline: typing.Optional[float]) -> bool:
+    return deadline is not None and time.monotonic() > deadline
+
+
+def _check_deadline(deadline: typing.Optional[float]):
+    if _deadline_passed(deadline):
+        raise _DeadlineExpired()
+
+
 def main():
     left = _load_dataset_from_file("../data/mapping/v1/000005.json")
     right = _load_dataset_from_file("../data/mapping/v1/000049.json")
@@ -64,33 +151,135 @@ def _load_dataset_from_file(file: str) -> Dataset:
     return load_dataset_from_json(content)
 
 
-def load_dataset_from_json(content) -> Dataset:
+def load_dataset_from_json(
+        content, vocabulary: Vocabulary = default_vocabulary) -> Dataset:
     mappings = [
         Mapping(item["metadata"]["from"], item["metadata"], [
-            MappingItem(dataItem["id"], dataItem["metadata"])
+            MappingItem(
+                vocabulary.intern(dataItem["id"]), dataItem["metadata"])
             for dataItem in item["data"]
         ])
         for item in content["mappings"]
     ]
-    hierarchy = [
-        HierarchyEntry(item[0], item[1], item[2])
-        for item in content["hierarchy"]
-    ]
+    hierarchy = Hierarchy.from_entries(content["hierarchy"], vocabulary)
     return Dataset(content["@id"], mappings, hierarchy)
 
 
 # region Collect paths
 
-def find_all_path(left: Dataset, right: Dataset) -> typing.List[Path]:
-    adjacency_list = _prepare_adjacency_list(
-        [left.hierarchy, right.hierarchy])
-    result = []
-    for left_entry in _collect_entries(left):
-        for right_entry in _collect_entries(right):
-            result.extend(_find_path(adjacency_list, left_entry, right_entry))
+def find_all_path(
+        left: Dataset, right: Dataset, graph: HierarchyGraph = None,
+        engine: str = "multi-source") -> typing.List[Path]:
+    return search_paths(
+        left, right, graph, PathSearchOptions(engine=engine)).paths
+
+
+def search_paths(
+        left: Dataset, right: Dataset, graph: HierarchyGraph = None,
+        search_options: PathSearchOptions = None) -> PathSearchResult:
+    graph, left_entries, right_entries = prepare_graph(left, right, graph)
+    return search_graph_paths(
+        graph, left_entries, right_entries, search_options)
+
+
+def search_graph_paths(
+        graph: HierarchyGraph,
+        left_entries: typing.List[int], right_entries: typing.List[int],
+        search_options: PathSearchOptions = None) -> PathSearchResult:
+    """
+    Search paths between entries given by graph node IDs, as returned by
+    prepare_graph. Paths and cut hubs of the result use vocabulary IDs.
+    """
+    if search_options is None:
+        search_options = PathSearchOptions()
+    result = path_engines[search_options.engine](
+        graph, left_entries, right_entries, search_options)
+    result.paths = [_decode_path(graph, path) for path in result.paths]
+    result.cut_hubs = set(graph.decode(result.cut_hubs))
+    return result
+
+
+def search_paths_one_to_many(
+        graph: HierarchyGraph, query: str, candidates: typing.List[str],
+        search_options: PathSearchOptions = None) \
+        -> typing.Dict[str, PathSearchResult]:
+    """
+    Search paths from the query dataset to each of the candidate datasets,
+    all must be part of the graph. As the meeting of two entities does not
+    depend on other entities, we run one search from the query entities to
+    entities of all candidates and split the paths by candidate. Paths and
+    cut hubs use graph node IDs.
+    """
+    if search_options is None:
+        search_options = PathSearchOptions()
+    candidates_by_entry = {}
+    for candidate in candidates:
+        for entry in graph.datasets[candidate]:
+            candidates_by_entry.setdefault(entry, []).append(candidate)
+    search = path_engines[search_options.engine](
+        graph, list(graph.datasets[query]), sorted(candidates_by_entry),
+        search_options)
+    # Keep the order of paths as if each candidate was searched on its own.
+    result = {
+        candidate: PathSearchResult(
+            [], search.truncated, search.cut_hubs, search.partial,
+            search.searched_levels, search.searched_pairs)
+        for candidate in candidates
+    }
+    for path in search.paths:
+        for candidate in candidates_by_entry[path.nodes[-1]]:
+            result[candidate].paths.append(path)
+    for path_length in search.path_lengths:
+        for candidate in candidates_by_entry[path_length[1]]:
+            result[candidate].path_lengths.append(path_length)
     return result
 
 
+def create_search_options(
+        options, hub_degrees: typing.Sequence[int] = None) \
+        -> PathSearchOptions:
+    """
+    When distance is given both selectors drop paths longer than the
+    distance. A pair that meets in level k has paths of length at least
+    k - 1, so there is no need to search beyond level distance + 1.
+    The deadline is timeLimit seconds from now. With summaryOnly we do
+    not need all shortest paths. Hub degrees are used as given, so
+    the hub cap of a per-request graph can match the shared graph.
+    Raise ValueError for unknown engine, invalid distance, hub degree or
+    time limit.
+    """
+    engine = options.get("engine", "multi-source")
+    if engine not in path_engines:
+        raise ValueError("Unknown engine: {}".format(engine))
+    max_hub_degree = options.get("maxHubDegree")
+    if max_hub_degree is not None and (
+            not isinstance(max_hub_degree, int) or max_hub_degree < 0):
+        raise ValueError("Invalid maxHubDegree: {}".format(max_hub_degree))
+    deadline = None
+    time_limit = options.get("timeLimit")
+    if time_limit is not None:
+        if not isinstance(time_limit, (int, float)) or time_limit <= 0:
+            raise ValueError("Invalid timeLimit: {}".format(time_limit))
+        deadline = time.monotonic() + time_limit
+    distance = options.get("distance")
+    if "distance" in options and (
+            not isinstance(distance, int) or distance < 0):
+        raise ValueError("Invalid distance: {}".format(distance))
+    max_level = None
+    if "distance" in options or options.get("method") == "distance":
+        max_level = options.get("distance", 0) + 1
+    summary_only = options.get("summaryOnly", False)
+    return PathSearchOptions(
+        engine=engine,
+        max_level=max_level,
+        all_shortest=options.get("allShortestPaths", False)
+                     and not summary_only,
+        max_hub_degree=max_hub_degree,
+        hub_degrees=hub_degrees,
+        deadline=deadline,
+        summary_only=summary_only)
+
+
 def _collect_entries(dataset: Dataset):
     return list({
         item.entity
@@ -99,36 +288,104 @@ def _collect_entries(dataset: Dataset):
     })
 
 
-def _prepare_adjacency_list(
-        hierarchies: typing.List[typing.List[HierarchyEntry]]) \
-        -> AdjacencyList:
-    """Adjacency matrix target to source."""
-    edges: typing.Set[HierarchyEntry] = set(itertools.chain(*hierarchies))
-    result = {}
-    for edge in edges:
-        adjacency_list = result.get(edge.source, set())
-        adjacency_list.add(edge.target)
-        result[edge.source] = adjacency_list
+def prepare_graph(
+        left: Dataset, right: Dataset, graph: HierarchyGraph = None) \
+        -> typing.Tuple[HierarchyGraph, typing.List[int], typing.List[int]]:
+    """
+    Return graph with graph node IDs of the left and the right entities.
+    Use the shared graph if given and built from both datasets, otherwise
+    build the graph from the datasets' hierarchies. Datasets are found in
+    the shared graph by IRI, so the graph must be given only for datasets
+    loaded from the collection it was built from. Entities are not stored
+    with the built graph, as both datasets can have the same IRI.
+    """
+    if graph is not None and graph.covers(left, right):
+        return graph, list(graph.datasets[left.id]), \
+               list(graph.datasets[right.id])
+    left_entities = _collect_entries(left)
+    right_entities = _collect_entries(right)
+    graph = HierarchyGraph.from_hierarchies(
+        [left.hierarchy, right.hierarchy],
+        itertools.chain(left_entities, right_entities))
+    return graph, sorted(graph.encode(left_entities)), \
+           sorted(graph.encode(right_entities))
+
+
+def _decode_path(graph: HierarchyGraph, path: Path) -> Path:
+    return Path(graph.nodes[path.shared], graph.decode(path.nodes))
+
+
+def _find_all_path_pairwise(
+        graph: HierarchyGraph,
+        left_entries: typing.List[int], right_entries: typing.List[int],
+        search_options: PathSearchOptions) -> PathSearchResult:
+    """
+    Run bidirectional search for every pair of entities. After the
+    deadline remaining pairs are not searched.
+    """
+    result = PathSearchResult([])
+    hub_cap = _create_hub_cap(graph, search_options)
+    searched_pairs = 0
+    try:
+        for left_entry in left_entries:
+            for right_entry in right_entries:
+                paths, truncated = _find_path(
+                    graph, left_entry, right_entry, search_options.max_level,
+                    search_options.all_shortest, hub_cap,
+                    search_options.deadline)
+                if search_options.summary_only:
+                    result.path_lengths.extend(
+                        (left_entry, right_entry, path.shared, len(path.nodes))
+                        for path in paths)
+                else:
+                    result.paths.extend(paths)
+                result.truncated |= truncated
+                searched_pairs += 1
+    except _DeadlineExpired:
+        result.partial = True
+        result.searched_pairs = searched_pairs
+    if hub_cap is not None:
+        result.cut_hubs = hub_cap.cut
     return result
 
 
 def _find_path(
-        adjacency_list: AdjacencyList, left: str, right: str) \
-        -> typing.List[Path]:
+        graph: HierarchyGraph, left: int, right: int,
+        max_level: typing.Optional[int] = None, all_shortest: bool = False,
+        hub_cap: "_HubCap" = None, deadline: typing.Optional[float] = None) \
+        -> typing.Tuple[typing.List[Path], bool]:
+    """
+    Return found paths and true if the search was stopped by max_level
+    with nodes left to expand. Raise _DeadlineExpired after the deadline.
+    """
     if left == right:
-        return [Path(left, tuple([left]))]
+        return [Path(left, tuple([left]))], False
     left_visited = {left}
     left_level = {left}
     right_visited = {right}
     right_level = {right}
-    paths = {left: [left], right: [right]}
+    # Only parents are stored, paths are reconstructed for shared nodes.
+    root = [] if all_shortest else None
+    left_parents = {left: root}
+    right_parents = {right: root}
 
-    def expand_level(l, r):
-        return _expand_level(adjacency_list, paths, l, r)
+    def expand_level(v, l):
+        return _expand_level(graph, v, l, all_shortest, hub_cap)
 
+    level = 0
     while True:
-        left_level, left_paths = expand_level(left_visited, left_level)
-        right_level, right_paths = expand_level(right_visited, right_level)
+        if max_level is not None and level >= max_level:
+            # The same check as _can_expand, the pair has not met yet.
+            return [], any(
+                len(graph.get(node)) > 0
+                for node in itertools.chain(left_level, right_level))
+        _check_deadline(deadline)
+        level += 1
+        left_level, new_left_parents = expand_level(left_visited, left_level)
+        right_level, new_right_parents = \
+            expand_level(right_visited, right_level)
+        left_parents.update(new_left_parents)
+        right_parents.update(new_right_parents)
         # Check for intersections - i.e. if we have found the path.
         intersection = set().union(
             left_level.intersection(right_visited),
@@ -137,16 +394,9 @@ def _find_path(
             right_level.intersection(left_level),
         )
         if len(intersection) > 0:
-            result: typing.List[Path] = []
-            for shared in intersection:
-                left_shared = left_paths.get(shared, paths.get(shared))
-                right_shared = right_paths.get(shared, paths.get(shared))
-                right_shared.reverse()
-                path = tuple(left_shared + right_shared[1:])
-                result.append(Path(shared, path))
-            return result
-        paths.update(left_paths)
-        paths.update(right_paths)
+            return _create_paths(
+                sorted(intersection), left_parents.get, right_parents.get,
+                all_shortest), False
         # Filter out already visited.
         left_visited.update(left_level)
         right_visited.update(right_level)
@@ -154,59 +404,687 @@ def _find_path(
         if not left_level and not right_level:
             break
     # No path found.
-    return []
+    return [], False
 
 
 def _expand_level(
-        adjacency_list: AdjacencyList,
-        paths: typing.Dict[str, typing.List[str]],
-        visited: typing.Set[str],
-        level: typing.Set[str]):
+        graph: HierarchyGraph,
+        visited: typing.Set[int],
+        level: typing.Set[int],
+        all_shortest: bool = False,
+        hub_cap: "_HubCap" = None):
+    """Return new nodes and their parents, list of parents if all_shortest."""
     new_nodes = set()
-    new_paths = {}
+    new_parents = {}
     for source in level:
-        for target in adjacency_list.get(source, []):
+        for target in graph.get(source):
             if target in visited:
                 continue
+            if hub_cap is not None and hub_cap.cuts(target):
+                continue
             new_nodes.add(target)
-            #
-            path = paths[source].copy()
-            path.append(target)
-            new_paths[target] = path
-    return new_nodes, new_paths
+            if all_shortest:
+                new_parents.setdefault(target, []).append(source)
+            elif target not in new_parents or source < new_parents[target]:
+                new_parents[target] = source
+    return new_nodes, new_parents
+
+
+def _create_paths(
+        shared_nodes: typing.Iterable[int],
+        left_parent: typing.Callable, right_parent: typing.Callable,
+        all_shortest: bool) -> typing.List[Path]:
+    result = []
+    for shared in shared_nodes:
+        for left_path in _reconstruct_paths(left_parent, shared, all_shortest):
+            for right_path in _reconstruct_paths(
+                    right_parent, shared, all_shortest):
+                right_path.reverse()
+                result.append(Path(shared, tuple(left_path + right_path[1:])))
+    return result
+
+
+def _add_paths(
+        result: PathSearchResult, search_options: PathSearchOptions,
+        left_entry: int, right_entry: int,
+        shared_nodes: typing.Iterable[int],
+        left_parent: typing.Callable, right_parent: typing.Callable):
+    """Add paths, or path lengths with summary_only, to the result."""
+    if not search_options.summary_only:
+        result.paths.extend(_create_paths(
+            shared_nodes, left_parent, right_parent,
+            search_options.all_shortest))
+        return
+    for shared in shared_nodes:
+        result.path_lengths.append((
+            left_entry, right_entry, shared,
+            _count_nodes(left_parent, shared)
+            + _count_nodes(right_parent, shared) - 1))
+
+
+def _count_nodes(parent_of: typing.Callable, node: int) -> int:
+    """Return number of nodes of the path _reconstruct_paths would return."""
+    count = 1
+    parent = parent_of(node)
+    while parent is not None:
+        count += 1
+        parent = parent_of(parent)
+    return count
+
+
+def _reconstruct_paths(
+        parent_of: typing.Callable, node: int, all_shortest: bool) \
+        -> typing.List[typing.List[int]]:
+    """
+    Return paths from the search start to the node. The parent_of returns
+    parent of a node, None for the start, or with all_shortest list of
+    parents, empty for the start. All engines use the parent with the
+    smallest node ID, so they return the same paths.
+    """
+    if not all_shortest:
+        path = [node]
+        parent = parent_of(node)
+        while parent is not None:
+            path.append(parent)
+            parent = parent_of(parent)
+        path.reverse()
+        return [path]
+    parents = parent_of(node)
+    if not parents:
+        return [[node]]
+    return [
+        path + [node]
+        for parent in sorted(parents)
+        for path in _reconstruct_paths(parent_of, parent, True)
+    ]
+
+
+def _find_all_path_multi_source(
+        graph: HierarchyGraph,
+        left_entries: typing.List[int], right_entries: typing.List[int],
+        search_options: PathSearchOptions) -> PathSearchResult:
+    """
+    Expand all left and all right entities at once, each node remembers
+    which entities (labels) reached it and from which node. A pair of
+    entities meets in the first level where a node is reached by both of
+    them, as in _find_path all such nodes are used as shared nodes.
+    A label stops expanding once it has met all entities from the other side.
+    After the deadline we return paths of pairs met in complete levels.
+    """
+    all_shortest = search_options.all_shortest
+    hub_cap = _create_hub_cap(graph, search_options)
+    root = [] if all_shortest else None
+    # For each side: node -> {label: parent node}, or list of parents.
+    left_reached = {entry: {entry: root} for entry in left_entries}
+    right_reached = {entry: {entry: root} for entry in right_entries}
+    left_level = {entry: {entry} for entry in left_entries}
+    right_level = {entry: {entry} for entry in right_entries}
+    left_unmet = {entry: len(right_entries) for entry in left_entries}
+    right_unmet = {entry: len(left_entries) for entry in right_entries}
+    met: typing.Dict[typing.Tuple[int, int], typing.Set[int]] = {}
+    truncated = False
+    partial = False
+
+    level = 0
+    while left_level or right_level:
+        level_met = {}
+        for shared, labels in left_level.items():
+            for right_label in right_reached.get(shared, ()):
+                for left_label in labels:
+                    pair = (left_label, right_label)
+                    if pair not in met:
+                        level_met.setdefault(pair, set()).add(shared)
+        for shared, labels in right_level.items():
+            for left_label in left_reached.get(shared, ()):
+                for right_label in labels:
+                    pair = (left_label, right_label)
+                    if pair not in met:
+                        level_met.setdefault(pair, set()).add(shared)
+        for left_label, right_label in level_met.keys():
+            left_unmet[left_label] -= 1
+            right_unmet[right_label] -= 1
+        met.update(level_met)
+        if search_options.max_level is not None \
+                and level >= search_options.max_level:
+            truncated = _can_expand(graph, left_level, left_unmet) \
+                        or _can_expand(graph, right_level, right_unmet)
+            break
+        try:
+            # Nodes of an incomplete level are not used for any path.
+            left_level = _expand_labeled_level(
+                graph, left_reached, left_level, left_unmet, all_shortest,
+                hub_cap, search_options.deadline)
+            right_level = _expand_labeled_level(
+                graph, right_reached, right_level, right_unmet, all_shortest,
+                hub_cap, search_options.deadline)
+        except _DeadlineExpired:
+            partial = True
+            break
+        level += 1
+
+    result = PathSearchResult([], truncated)
+    if hub_cap is not None:
+        result.cut_hubs = hub_cap.cut
+    if partial:
+        result.partial = True
+        result.searched_levels = level
+    for left_entry in left_entries:
+        for right_entry in right_entries:
+            shared_nodes = met.get((left_entry, right_entry))
+            if not shared_nodes:
+                continue
+            _add_paths(
+                result, search_options, left_entry, right_entry,
+                sorted(shared_nodes),
+                lambda node: left_reached[node][left_entry],
+                lambda node: right_reached[node][right_entry])
+    return result
+
+
+def _expand_labeled_level(
+        graph: HierarchyGraph,
+        reached: typing.Dict[int, typing.Dict[int, typing.Any]],
+        level: typing.Dict[int, typing.Set[int]],
+        unmet: typing.Dict[int, int],
+        all_shortest: bool = False,
+        hub_cap: "_HubCap" = None,
+        deadline: typing.Optional[float] = None) \
+        -> typing.Dict[int, typing.Set[int]]:
+    """Raise _DeadlineExpired after the deadline."""
+    new_level = {}
+    for position, (source, labels) in enumerate(level.items()):
+        if position % DEADLINE_CHECK_INTERVAL == 0:
+            _check_deadline(deadline)
+        labels = [label for label in labels if unmet[label] > 0]
+        if not labels:
+            continue
+        for target in graph.get(source):
+            if hub_cap is not None and hub_cap.cuts(target):
+                continue
+            target_reached = reached.setdefault(target, {})
+            for label in labels:
+                if label in target_reached:
+                    if label not in new_level.get(target, ()):
+                        continue
+                    # Another parent in the same level.
+                    if all_shortest:
+                        target_reached[label].append(source)
+                    elif source < target_reached[label]:
+                        target_reached[label] = source
+                    continue
+                target_reached[label] = [source] if all_shortest else source
+                new_level.setdefault(target, set()).add(label)
+    return new_level
+
+
+def _can_expand(
+        graph: HierarchyGraph,
+        level: typing.Dict[int, typing.Set[int]],
+        unmet: typing.Dict[int, int]) -> bool:
+    return any(
+        len(graph.get(node)) > 0
+        and any(unmet[label] > 0 for label in labels)
+        for node, labels in level.items())
+
+
+class _HubCap:
+    """
+    Generic nodes, with more incoming edges than max_degree, are not
+    entered by the search. Such nodes are collected in cut. Degrees are
+    taken from entity_degrees, see PathSearchOptions.hub_degrees.
+    """
+
+    def __init__(
+            self, graph: HierarchyGraph, max_degree: int,
+            entity_degrees: typing.Sequence[int] = None):
+        self.nodes = graph.nodes
+        self.degrees = graph.in_degrees()
+        self.entity_degrees = entity_degrees
+        self.max_degree = max_degree
+        self.cut = set()
+
+    def cuts(self, node: int) -> bool:
+        if self.degree(node) > self.max_degree:
+            self.cut.add(node)
+            return True
+        return False
+
+    def degree(self, node: int) -> int:
+        if self.entity_degrees is not None:
+            entity = self.nodes[node]
+            if entity < len(self.entity_degrees) \
+                    and self.entity_degrees[entity] >= 0:
+                return self.entity_degrees[entity]
+        return self.degrees[node]
+
+
+def _create_hub_cap(
+        graph: HierarchyGraph, search_options: PathSearchOptions) \
+        -> typing.Optional[_HubCap]:
+    if search_options.max_hub_degree is None:
+        return None
+    return _HubCap(
+        graph, search_options.max_hub_degree, search_options.hub_degrees)
+
+
+def _find_all_path_closure(
+        graph: HierarchyGraph,
+        left_entries: typing.List[int], right_entries: typing.List[int],
+        search_options: PathSearchOptions) -> PathSearchResult:
+    """
+    Use precomputed ancestor closures, a pair meets at the first level
+    where sets of ancestors within the level intersect and the shared
+    nodes are the intersection, as in _find_all_path_multi_source.
+    Paths are reconstructed only for the shared nodes.
+    """
+    if search_options.max_hub_degree is not None:
+        # Closures are computed without the hub cap.
+        return _find_all_path_multi_source(
+            graph, left_entries, right_entries, search_options)
+    closures = get_ancestor_closures(graph)
+    max_level = search_options.max_level
+    if max_level is None:
+        # Datasets without mapped entities have no depth.
+        level_count = 1 + max((
+            closures.get(entry).depth()
+            for entry in itertools.chain(left_entries, right_entries)),
+            default=0)
+    else:
+        level_count = max_level + 1
+    right_within = [
+        _closure_within(closures.get(entry), level_count)
+        for entry in right_entries
+    ]
+    # Entries with a pair not met within max_level.
+    left_unmet = set()
+    right_unmet = set()
+    met = []
+    partial = False
+    searched_pairs = 0
+    for left_entry in left_entries:
+        if _deadline_passed(search_options.deadline):
+            partial = True
+            break
+        searched_pairs += len(right_entries)
+        left_within = _closure_within(closures.get(left_entry), level_count)
+        for right_entry, right_entry_within in zip(
+                right_entries, right_within):
+            for left_nodes, right_nodes in zip(
+                    left_within, right_entry_within):
+                if not left_nodes.isdisjoint(right_nodes):
+                    met.append((
+                        left_entry, right_entry,
+                        sorted(left_nodes & right_nodes)))
+                    break
+            else:
+                left_unmet.add(left_entry)
+                right_unmet.add(right_entry)
+
+    truncated = max_level is not None and any(
+        len(graph.get(node)) > 0
+        for entry in itertools.chain(left_unmet, right_unmet)
+        for node in closures.get(entry).level(max_level))
+
+    all_shortest = search_options.all_shortest
+    parents = {}
+    result = PathSearchResult([], truncated)
+    for left_entry, right_entry, shared_nodes in met:
+        for entry in (left_entry, right_entry):
+            if entry not in parents:
+                parents[entry] = _closure_parent_of(
+                    graph, closures.get(entry), all_shortest)
+        _add_paths(
+            result, search_options, left_entry, right_entry, shared_nodes,
+            parents[left_entry], parents[right_entry])
+    if partial:
+        result.partial = True
+        result.searched_pairs = searched_pairs
+    return result
+
+
+def _closure_within(
+        closure: AncestorClosure, level_count: int) -> typing.List[frozenset]:
+    """Return sets of nodes within each level, for given number of levels."""
+    result = closure.within(level_count - 1)
+    return result + [result[-1]] * (level_count - len(result))
+
+
+def _closure_parent_of(
+        graph: HierarchyGraph, closure: AncestorClosure,
+        all_shortest: bool) -> typing.Callable:
+    """
+    Parent function for _reconstruct_paths, parents of a node are nodes
+    in the previous level with an edge to the node.
+    """
+    if not all_shortest:
+        parents = closure.parent_map()
+
+        def first_parent_of(node: int):
+            parent = parents[node]
+            return None if parent == -1 else parent
+
+        return first_parent_of
+
+    distances = closure.distances()
+    cache = {}
+
+    def parent_of(node: int):
+        if node in cache:
+            return cache[node]
+        distance = distances[node]
+        if distance == 0:
+            return []
+        cache[node] = sorted(
+            source for source in closure.level(distance - 1)
+            if node in graph.get(source))
+        return cache[node]
+
+    return parent_of
+
+
+path_engines = {
+    "multi-source": _find_all_path_multi_source,
+    "pairwise": _find_all_path_pairwise,
+    "closure": _find_all_path_closure,
+}
+
+
+# endregion
+
+# region Sparse matrix engine
+
+# Sparse matrices of graphs used by the sparse engine.
+_sparse_graphs = weakref.WeakKeyDictionary()
+
+
+def _find_all_path_sparse(
+        graph: HierarchyGraph,
+        left_entries: typing.List[int], right_entries: typing.List[int],
+        search_options: PathSearchOptions) -> PathSearchResult:
+    """
+    Same search as _find_all_path_multi_source, but each side stores
+    reached nodes as a sparse matrix (nodes x labels) and every level
+    is expanded by a single sparse matrix product. Labels are positions
+    of the entries.
+    """
+    incoming, out_degree = _get_sparse_graph(graph)
+    node_count = len(graph)
+    hubs = None
+    if search_options.max_hub_degree is not None:
+        hubs = _sparse_degrees(graph, search_options.hub_degrees) \
+               > search_options.max_hub_degree
+    right_count = len(right_entries)
+    left = _SparseSide(node_count, left_entries, right_count)
+    right = _SparseSide(node_count, right_entries, len(left_entries))
+    # Pair key is left label * number of right labels + right label.
+    met_keys = numpy.empty(0, dtype=numpy.int64)
+    met_pairs = []
+    met_shared = []
+    truncated = False
+    partial = False
+
+    level = 0
+    while left.frontier.nnz or right.frontier.nnz:
+        left_labels, right_labels, shared = [
+            numpy.concatenate(items) for items in zip(
+                _shared_nodes(left.frontier, right.reached),
+                _shared_nodes(left.reached, right.frontier))
+        ]
+        keys = left_labels * right_count + right_labels
+        new = ~numpy.isin(keys, met_keys)
+        # A node can be in both frontiers, unique also sorts the nodes.
+        triples = numpy.unique(keys[new] * node_count + shared[new])
+        keys, shared = numpy.divmod(triples, node_count)
+        new_keys = numpy.unique(keys)
+        left.unmet -= numpy.bincount(
+            new_keys // right_count, minlength=len(left_entries))
+        right.unmet -= numpy.bincount(
+            new_keys % right_count, minlength=right_count)
+        met_keys = numpy.union1d(met_keys, new_keys)
+        met_pairs.append(keys)
+        met_shared.append(shared)
+        if search_options.max_level is not None \
+                and level >= search_options.max_level:
+            truncated = left.can_expand(out_degree) \
+                        or right.can_expand(out_degree)
+            break
+        if _deadline_passed(search_options.deadline):
+            partial = True
+            break
+        level += 1
+        left.expand(incoming, level, hubs)
+        right.expand(incoming, level, hubs)
+
+    result = PathSearchResult([], truncated, left.cut | right.cut)
+    if partial:
+        result.partial = True
+        result.searched_levels = level
+    if not met_pairs:
+        # Datasets without mapped entities.
+        return result
+    # Order paths as _find_all_path_multi_source does.
+    keys = numpy.concatenate(met_pairs)
+    shared = numpy.concatenate(met_shared)
+    order = numpy.lexsort((shared, keys))
+    keys, shared = keys[order], shared[order]
+    starts = numpy.flatnonzero(numpy.diff(keys, prepend=-1))
+    ends = numpy.append(starts[1:], len(keys))
+    all_shortest = search_options.all_shortest
+    left_parents = _SparseParents(incoming, left.reached, all_shortest)
+    right_parents = _SparseParents(incoming, right.reached, all_shortest)
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        left_label, right_label = divmod(int(keys[start]), right_count)
+        _add_paths(
+            result, search_options,
+            left_entries[left_label], right_entries[right_label],
+            shared[start:end].tolist(),
+            left_parents.parent_of(left_label),
+            right_parents.parent_of(right_label))
+    return result
+
+
+def _get_sparse_graph(graph: HierarchyGraph):
+    """Return matrix with sources of edges to each node and out degrees."""
+    if graph not in _sparse_graphs:
+        node_count = len(graph)
+        offsets = numpy.frombuffer(graph.offsets, dtype=numpy.int64)
+        targets = numpy.frombuffer(graph.targets, dtype=numpy.int32)
+        outgoing = scipy.sparse.csr_matrix(
+            (numpy.ones(len(targets), dtype=numpy.int32), targets, offsets),
+            shape=(node_count, node_count))
+        incoming = outgoing.transpose().tocsr()
+        incoming.sort_indices()
+        _sparse_graphs[graph] = (incoming, numpy.diff(offsets))
+    return _sparse_graphs[graph]
+
+
+def _sparse_degrees(
+        graph: HierarchyGraph,
+        entity_degrees: typing.Optional[typing.Sequence[int]]):
+    """Return in degree of each node, as _HubCap.degree ."""
+    result = numpy.frombuffer(graph.in_degrees(), dtype=numpy.int32)
+    if entity_degrees is None or len(graph) == 0:
+        return result
+    entity_degrees = numpy.asarray(entity_degrees, dtype=numpy.int32)
+    entities = numpy.asarray(graph.nodes, dtype=numpy.int64)
+    known = entities < len(entity_degrees)
+    shared = numpy.full(len(entities), -1, dtype=numpy.int32)
+    shared[known] = entity_degrees[entities[known]]
+    return numpy.where(shared >= 0, shared, result)
+
+
+class _SparseSide:
+    """
+    Reached stores level + 1 for each reached node and label, frontier
+    ones for nodes reached in the last level.
+    """
+
+    def __init__(
+            self, node_count: int, entries: typing.List[int],
+            other_count: int):
+        self.frontier = scipy.sparse.csr_matrix(
+            (numpy.ones(len(entries), dtype=numpy.int32),
+             (entries, numpy.arange(len(entries)))),
+            shape=(node_count, len(entries)))
+        self.reached = self.frontier.copy()
+        self.unmet = numpy.full(len(entries), other_count, dtype=numpy.int64)
+        self.cut = set()
+
+    def expand(self, incoming, level: int, hubs=None):
+        """
+        Labels that met all labels from the other side are not expanded.
+        Nodes marked in hubs are not entered.
+        """
+        active = scipy.sparse.diags(
+            (self.unmet > 0).astype(numpy.int32), dtype=numpy.int32)
+        frontier = incoming @ (self.frontier @ active)
+        frontier.eliminate_zeros()
+        if hubs is not None:
+            rows = numpy.unique(frontier.tocoo().row)
+            self.cut.update(rows[hubs[rows]].tolist())
+            frontier = scipy.sparse.diags(
+                (~hubs).astype(numpy.int32), dtype=numpy.int32) @ frontier
+            frontier.eliminate_zeros()
+        frontier.data[:] = 1
+        frontier = frontier - frontier.multiply(self.reached > 0)
+        frontier.eliminate_zeros()
+        self.frontier = frontier.tocsr()
+        self.reached = (self.reached + self.frontier * (level + 1)).tocsr()
+
+    def can_expand(self, out_degree) -> bool:
+        frontier = self.frontier.tocoo()
+        return bool(numpy.any(
+            (out_degree[frontier.row] > 0) & (self.unmet[frontier.col] > 0)))
 
 
+def _shared_nodes(first, second):
+    """
+    Return first labels, second labels and nodes, for each node reached
+    by both matrices and each combination of labels that reached it.
+    """
+    first = first.tocsr()
+    second = second.tocsr()
+    first_counts = numpy.diff(first.indptr)
+    second_counts = numpy.diff(second.indptr)
+    # Node of each value in first.
+    nodes = numpy.repeat(numpy.arange(first.shape[0]), first_counts)
+    repeats = second_counts[nodes]
+    total = int(repeats.sum())
+    first_labels = numpy.repeat(first.indices, repeats).astype(numpy.int64)
+    # Position in the row of second matrix for each combination.
+    run_starts = numpy.repeat(numpy.cumsum(repeats) - repeats, repeats)
+    positions = numpy.repeat(second.indptr[nodes], repeats) \
+                + numpy.arange(total) - run_starts
+    second_labels = second.indices[positions].astype(numpy.int64)
+    return first_labels, second_labels, numpy.repeat(nodes, repeats)
+
+
+class _SparseParents:
+    """
+    Parent functions for _reconstruct_paths, for each label we convert
+    the reached column to a dictionary on first use.
+    """
+
+    def __init__(self, incoming, reached, all_shortest: bool):
+        self._incoming = incoming
+        self._reached = reached.tocsc()
+        self._all_shortest = all_shortest
+        self._functions = {}
+
+    def parent_of(self, label: int) -> typing.Callable:
+        if label in self._functions:
+            return self._functions[label]
+        start = self._reached.indptr[label]
+        end = self._reached.indptr[label + 1]
+        levels = dict(zip(
+            self._reached.indices[start:end].tolist(),
+            self._reached.data[start:end].tolist()))
+        offsets = self._incoming.indptr
+        sources = self._incoming.indices
+        all_shortest = self._all_shortest
+        # Paths of a label share nodes, so we remember the parents.
+        cache = {}
+
+        def parent_of(node: int):
+            if node in cache:
+                return cache[node]
+            level = levels[node]
+            if level == 1:
+                return [] if all_shortest else None
+            # Sources are sorted, so the first parent is the smallest.
+            parents = [
+                source for source in
+                sources[offsets[node]:offsets[node + 1]].tolist()
+                if levels.get(source) == level - 1
+            ]
+            cache[node] = parents if all_shortest else parents[0]
+            return cache[node]
+
+        self._functions[label] = parent_of
+        return parent_of
+
+
+if scipy is not None:
+    path_engines["sparse"] = _find_all_path_sparse
+
 # endregion
 
 def paths_to_output(
         paths: typing.List[Path], datasets: typing.List[Dataset],
-        metadata: typing.Dict = None):
-    # Subtract 2 for start and end node.
-    path_lengths = [max(len(path.nodes) - 2, 0) for path in paths]
-
+        metadata: typing.Dict = None, compact: bool = False,
+        vocabulary: Vocabulary = default_vocabulary):
+    """
+    In compact output every node is listed once in "nodes" and paths
+    refer to the nodes using their index.
+    """
     if metadata is None:
         metadata = {}
 
-    similarity = { }
-    if path_lengths:
-        similarity["max"] = max(path_lengths)
-        similarity["average"] = sum(path_lengths) / len(path_lengths)
-        similarity["sum"] = sum(path_lengths)
-        similarity["min"] = min(path_lengths)
-
-    return {
+    result = {
         "metadata": {
             **metadata,
             "datasets": [dataset.id for dataset in datasets],
         },
-        "similarity": similarity,
-        "paths": [
+        "similarity": paths_to_similarity(paths),
+    }
+    if not compact:
+        result["paths"] = [
             {
-                "shared": path.shared,
-                "nodes": path.nodes,
+                "shared": vocabulary[path.shared],
+                "nodes": vocabulary.decode(path.nodes),
             } for path in paths
         ]
-    }
+        return result
+
+    node_index = {}
+
+    def index_of(node: int) -> int:
+        return node_index.setdefault(node, len(node_index))
+
+    result["paths"] = [
+        {
+            "shared": index_of(path.shared),
+            "nodes": [index_of(node) for node in path.nodes],
+        } for path in paths
+    ]
+    result["nodes"] = list(vocabulary.decode(node_index.keys()))
+    return result
+
+
+def paths_to_similarity(paths: typing.List[Path]) -> typing.Dict:
+    # Subtract 2 for start and end node.
+    path_lengths = [max(len(path.nodes) - 2, 0) for path in paths]
+    return lengths_to_similarity(path_lengths)
+
+
+def lengths_to_similarity(path_lengths: typing.List[float]) -> typing.Dict:
+    similarity = { }
+    if path_lengths:
+        similarity["max"] = max(path_lengths)
+        similarity["average"] = sum(path_lengths) / len(path_lengths)
+        similarity["sum"] = sum(path_lengths)
+        similarity["min"] = min(path_lengths)
+    return similarity
 
 
 # region Path filters and selectors
@@ -246,6 +1124,546 @@ def select_closest_for_each(paths: typing.List[Path], options: any = None) \
     return unique_paths
 
 
+path_filter_selectors = {
+    "closest": select_closest_for_each,
+    "distance": select_paths_by_length,
+    # With a landmark index the summary is computed by estimate_closest,
+    # otherwise we select the paths as closest does.
+    "landmark": select_closest_for_each,
+}
+
+
+def select_paths(paths: typing.List[Path], options) -> typing.List[Path]:
+    method = options.get("method", "closest")
+    return path_filter_selectors[method](paths, options)
+
+
+def select_lengths_by_distance(path_lengths, options) -> typing.List[int]:
+    """Path lengths version of select_paths_by_length."""
+    max_length = options.get("distance", 0) + 2
+    return [
+        max(item[3] - 2, 0) for item in path_lengths if item[3] <= max_length
+    ]
+
+
+def select_closest_lengths(path_lengths, options: any = None) \
+        -> typing.List[int]:
+    """
+    Path lengths version of select_closest_for_each, a path is identified
+    by its entities and shared node.
+    """
+    shortest = {}
+
+    def update_shortest(item: int, new_path):
+        if item not in shortest or shortest[item][3] > new_path[3]:
+            shortest[item] = new_path
+
+    for path_length in path_lengths:
+        update_shortest(path_length[0], path_length)
+        update_shortest(path_length[1], path_length)
+
+    unique = set(shortest.values())
+
+    if "distance" in options:
+        return select_lengths_by_distance(unique, options)
+
+    return [max(item[3] - 2, 0) for item in unique]
+
+
+path_length_selectors = {
+    "closest": select_closest_lengths,
+    "distance": select_lengths_by_distance,
+    "landmark": select_closest_lengths,
+}
+
+
+def select_lengths(path_lengths, options) -> typing.List[int]:
+    """Return lengths of paths selected as by select_paths."""
+    method = options.get("method", "closest")
+    return path_length_selectors[method](path_lengths, options)
+
+
+# endregion
+
+# region Landmark estimates
+
+@dataclass
+class SimilarityEstimate:
+    similarity: typing.Dict
+    """Number of entities with length given by the landmark bounds."""
+    estimated: int = 0
+    """Number of entities with length found by the exact search."""
+    searched: int = 0
+    """Number of entities without a path."""
+    unreachable: int = 0
+    """True if the exact search was stopped by the deadline."""
+    partial: bool = False
+    """Graph nodes not entered by the exact search, see max_hub_degree."""
+    cut_hubs: typing.Set[int] = field(default_factory=set)
+
+    def counts(self) -> typing.Dict[str, int]:
+        return {
+            "estimated": self.estimated,
+            "searched": self.searched,
+            "unreachable": self.unreachable,
+        }
+
+
+def estimate_closest(
+        graph: HierarchyGraph, index: LandmarkIndex,
+        left_entries: typing.List[int], right_entries: typing.List[int],
+        options, search_options: PathSearchOptions = None) \
+        -> SimilarityEstimate:
+    """
+    Summary of length of the shortest path of each entity, as selected by
+    select_closest_for_each. When the landmark bounds of an entity differ
+    by at most options["tolerance"], default 0, we use their middle,
+    otherwise we search the paths. Unlike select_closest_for_each, a path
+    shortest for two entities is counted for both of them. Search options
+    are created from the options unless given.
+    """
+    return _estimate_closest(
+        graph, index, left_entries, {None: right_entries}, options,
+        search_options)[None]
+
+
+def estimate_closest_one_to_many(
+        graph: HierarchyGraph, index: LandmarkIndex, query: str,
+        candidates: typing.List[str], options,
+        search_options: PathSearchOptions = None) \
+        -> typing.Dict[str, SimilarityEstimate]:
+    """
+    Same as estimate_closest for the query and each candidate, entities
+    of all candidates are searched at once. Datasets must be part of the
+    graph, the deadline is shared by all candidates.
+    """
+    return _estimate_closest(
+        graph, index, list(graph.datasets[query]), {
+            candidate: list(graph.datasets[candidate])
+            for candidate in candidates
+        }, options, search_options)
+
+
+def _estimate_closest(
+        graph: HierarchyGraph, index: LandmarkIndex,
+        left_entries: typing.List[int],
+        candidates: typing.Dict[typing.Any, typing.List[int]],
+        options, search_options: PathSearchOptions = None) \
+        -> typing.Dict[typing.Any, SimilarityEstimate]:
+    """
+    Entities without close enough bounds are resolved by one search for
+    all candidates. The search looks only for paths shorter than the upper
+    bound, without them the upper bound is the length.
+    """
+    tolerance = options.get("tolerance", 0)
+    max_distance = options.get("distance")
+    if search_options is None:
+        search_options = create_search_options(options)
+    # Landmark distances ignore the hub cap, so only the lower bound holds.
+    capped = search_options.max_hub_degree is not None
+    left_targets = index.targets(left_entries)
+    result = {}
+    lengths = {}
+    # Entities to search, with the upper bound of their length.
+    left_limits = {}
+    right_limits = {}
+    unresolved_right = {}
+    for candidate, right_entries in candidates.items():
+        estimate = SimilarityEstimate({})
+        result[candidate] = estimate
+        lengths[candidate] = []
+        right_targets = index.targets(right_entries)
+        unresolved = ({}, {})
+        for side, entries, targets in (
+                (0, left_entries, right_targets),
+                (1, right_entries, left_targets)):
+            for entry in entries:
+                lower, upper = index.bounds(entry, targets)
+                if capped and entry not in targets.entities:
+                    upper = math.inf
+                if lower == math.inf or \
+                        (max_distance is not None and lower > max_distance):
+                    estimate.unreachable += 1
+                elif upper - lower <= tolerance:
+                    estimate.estimated += 1
+                    lengths[candidate].append(
+                        lower if lower == upper else (lower + upper) / 2)
+                elif max_distance is None:
+                    unresolved[side][entry] = upper
+                else:
+                    # Nothing found up to max_distance means no path.
+                    unresolved[side][entry] = min(upper, max_distance + 1)
+        if unresolved[0]:
+            left_limits[candidate] = unresolved[0]
+        right_limits.update(unresolved[1])
+        unresolved_right[candidate] = list(unresolved[1])
+
+    # Unresolved entities are searched against all entities of the other
+    # dataset, the other entities only against them.
+    search_right = set(right_limits)
+    for candidate in left_limits:
+        search_right.update(candidates[candidate])
+    if right_limits:
+        search_left = left_entries
+    else:
+        search_left = sorted(set(itertools.chain(*left_limits.values())))
+    if not search_left or not search_right:
+        for candidate, estimate in result.items():
+            estimate.similarity = lengths_to_similarity(lengths[candidate])
+        return result
+    right_candidates = {}
+    for candidate, right_entries in candidates.items():
+        for entry in right_entries:
+            right_candidates.setdefault(entry, []).append(candidate)
+    search = _search_closest(
+        graph, search_left, sorted(search_right), left_limits, right_limits,
+        right_candidates, search_options)
+
+    for candidate, estimate in result.items():
+        estimate.cut_hubs = search.cut_hubs
+        estimate.partial = search.partial
+        found = [
+            min(limit, search.left[candidate].get(entry, math.inf))
+            for entry, limit in left_limits.get(candidate, {}).items()
+        ] + [
+            min(right_limits[entry], search.right.get(entry, math.inf))
+            for entry in unresolved_right[candidate]
+        ]
+        for length in found:
+            if length == math.inf or \
+                    (max_distance is not None and length > max_distance):
+                estimate.unreachable += 1
+            else:
+                estimate.searched += 1
+                lengths[candidate].append(length)
+        estimate.similarity = lengths_to_similarity(lengths[candidate])
+    return result
+
+
+@dataclass
+class _ClosestSearch:
+    """Lengths of the shortest paths of left entities by candidate."""
+    left: typing.Dict[typing.Any, typing.Dict[int, int]]
+    """Lengths of the shortest paths of right entities."""
+    right: typing.Dict[int, int]
+    cut_hubs: typing.Set[int] = field(default_factory=set)
+    partial: bool = False
+
+
+def _search_closest(
+        graph: HierarchyGraph,
+        left_entries: typing.List[int], right_entries: typing.List[int],
+        left_limits: typing.Dict[typing.Any, typing.Dict[int, float]],
+        right_limits: typing.Dict[int, float],
+        right_candidates: typing.Dict[int, typing.List[typing.Any]],
+        search_options: PathSearchOptions) -> _ClosestSearch:
+    """
+    Return length of the shortest path of entities given by the limits,
+    left entities for each candidate, as the multi-source search would,
+    the engine option is not used. Only paths shorter than the limit, or
+    the shortest path found so far, are searched. A pair meeting in level
+    k has paths of length at least k - 1, so an entity with limit l needs
+    no level after l. A label expands while its entity, or an entity of
+    the other side it has not met, needs the next level.
+    """
+    hub_cap = _create_hub_cap(graph, search_options)
+    left_reached = {entry: {entry: None} for entry in left_entries}
+    right_reached = {entry: {entry: None} for entry in right_entries}
+    left_level = {entry: {entry} for entry in left_entries}
+    right_level = {entry: {entry} for entry in right_entries}
+    # Labels stop expanding when the count is zero.
+    left_active = dict.fromkeys(left_entries, 1)
+    right_active = dict.fromkeys(right_entries, 1)
+    met = set()
+    result = _ClosestSearch(
+        {candidate: {} for candidate in left_limits}, {})
+
+    def needed_levels() -> typing.Tuple[typing.Dict[int, float], ...]:
+        """Return the last level needed by each left and right entity."""
+        left_needed = {}
+        for candidate, limits in left_limits.items():
+            found = result.left[candidate]
+            for entry, limit in limits.items():
+                left_needed[entry] = max(
+                    left_needed.get(entry, -1),
+                    min(limit, found.get(entry, math.inf)))
+        right_needed = {
+            entry: min(limit, result.right.get(entry, math.inf))
+            for entry, limit in right_limits.items()
+        }
+        return left_needed, right_needed
+
+    def stop_labels(
+            active: typing.Dict[int, int], needed: typing.Dict[int, float],
+            other_needed: typing.Dict[int, float], pair: typing.Callable):
+        others = [
+            other for other, last in other_needed.items() if last > level
+        ]
+        for label in active:
+            if active[label] == 0 or needed.get(label, -1) > level:
+                continue
+            if all(pair(label, other) in met for other in others):
+                active[label] = 0
+
+    def update(found: typing.Dict[int, int], entry: int, length: int):
+        if length < found.get(entry, math.inf):
+            found[entry] = length
+
+    def depth(reached: typing.Dict, label: int, node: int) -> int:
+        count = 0
+        parent = reached[node][label]
+        while parent is not None:
+            count += 1
+            parent = reached[parent][label]
+        return count
+
+    def record(left_label: int, right_label: int, length: int):
+        if right_label in right_limits:
+            update(result.right, right_label, length)
+        for candidate in right_candidates[right_label]:
+            if left_label in left_limits.get(candidate, ()):
+                update(result.left[candidate], left_label, length)
+
+    def last_level(
+            nodes: typing.Dict[int, typing.Set[int]],
+            active: typing.Dict[int, int], needed: typing.Dict[int, float],
+            other_needed: typing.Dict[int, float],
+            other_entries: typing.Iterable[int], pair: typing.Callable):
+        # Paths have level + 1 nodes from this side and one from the other.
+        others = set(other_entries)
+        for position, (source, labels) in enumerate(nodes.items()):
+            if position % DEADLINE_CHECK_INTERVAL == 0:
+                _check_deadline(search_options.deadline)
+            labels = [label for label in labels if active[label] > 0]
+            if not labels:
+                continue
+            for target in graph.get(source):
+                if target not in others or \
+                        (hub_cap is not None and hub_cap.cuts(target)):
+                    continue
+                for label in labels:
+                    if pair(label, target) in met or (
+                            needed.get(label, -1) <= level
+                            and other_needed.get(target, -1) <= level):
+                        continue
+                    record(*pair(label, target), level)
+
+    level = 0
+    left_needed, right_needed = needed_levels()
+    while left_level or right_level:
+        # Pairs of entities which need no more levels are not recorded.
+        left_open = {
+            entry for entry, last in left_needed.items() if last >= level}
+        right_open = {
+            entry for entry, last in right_needed.items() if last >= level}
+        level_met = {}
+        for shared, labels in left_level.items():
+            for right_label in right_reached.get(shared, ()):
+                right_open_label = right_label in right_open
+                for left_label in labels:
+                    pair = (left_label, right_label)
+                    if pair not in met and \
+                            (right_open_label or left_label in left_open):
+                        level_met.setdefault(pair, set()).add(shared)
+        for shared, labels in right_level.items():
+            for left_label in left_reached.get(shared, ()):
+                left_open_label = left_label in left_open
+                for right_label in labels:
+                    pair = (left_label, right_label)
+                    if pair not in met and \
+                            (left_open_label or right_label in right_open):
+                        level_met.setdefault(pair, set()).add(shared)
+        for (left_label, right_label), shared_nodes in level_met.items():
+            # Paths have one shared node and no first and last node.
+            length = max(min(
+                depth(left_reached, left_label, shared)
+                + depth(right_reached, right_label, shared)
+                for shared in shared_nodes) - 1, 0)
+            record(left_label, right_label, length)
+        met.update(level_met)
+        left_needed, right_needed = needed_levels()
+        left_last = max(left_needed.values(), default=-1)
+        right_last = max(right_needed.values(), default=-1)
+        if level >= max(left_last, right_last):
+            break
+        if search_options.max_level is not None \
+                and level >= search_options.max_level:
+            break
+        stop_labels(
+            left_active, left_needed, right_needed,
+            lambda label, other: (label, other))
+        stop_labels(
+            right_active, right_needed, left_needed,
+            lambda label, other: (other, label))
+        if level + 1 >= max(left_last, right_last):
+            # In the last level only paths ending in an entity of the other
+            # side are short enough, so we do not expand the level.
+            try:
+                last_level(
+                    left_level, left_active, left_needed, right_needed,
+                    right_entries, lambda label, other: (label, other))
+                last_level(
+                    right_level, right_active, right_needed, left_needed,
+                    left_entries, lambda label, other: (other, label))
+            except _DeadlineExpired:
+                result.partial = True
+            break
+        try:
+            left_level = _expand_labeled_level(
+                graph, left_reached, left_level, left_active, False,
+                hub_cap, search_options.deadline)
+            right_level = _expand_labeled_level(
+                graph, right_reached, right_level, right_active, False,
+                hub_cap, search_options.deadline)
+        except _DeadlineExpired:
+            result.partial = True
+            break
+        level += 1
+
+    if hub_cap is not None:
+        result.cut_hubs = hub_cap.cut
+    return result
+
+
+# endregion
+
+# region Common ancestors
+
+@dataclass
+class CommonAncestor:
+    """Node reached from entities of several datasets."""
+    node: int
+    """Distance from the closest entity, by position of the dataset."""
+    distances: typing.Dict[int, int]
+    """Path from the closest entity to the node, by position of the dataset."""
+    paths: typing.Dict[int, typing.List[int]] = field(default_factory=dict)
+
+
+@dataclass
+class CommonAncestorsResult:
+    ancestors: typing.List[CommonAncestor]
+    """True if the search was stopped by max_level with nodes left."""
+    truncated: bool = False
+    cut_hubs: typing.Set[int] = field(default_factory=set)
+    """True if the search was stopped by the deadline."""
+    partial: bool = False
+    """Number of levels searched for all datasets, set for partial results."""
+    searched_levels: typing.Optional[int] = None
+
+
+def find_common_ancestors(
+        graph: HierarchyGraph, datasets: typing.List[str],
+        min_datasets: typing.Optional[int] = None,
+        search_options: PathSearchOptions = None,
+        limit: typing.Optional[int] = None) -> CommonAncestorsResult:
+    """
+    Return nodes reached from entities of at least min_datasets, default
+    all, of the datasets. Datasets must be part of the graph, nodes use
+    graph node IDs. Unlike pairwise comparison we run a single search
+    where each dataset is one label, so a node is reached by a dataset
+    through its closest entity. Search_options.max_level limits the
+    distance. Ancestors are ordered by number of datasets, the biggest
+    and the total distance, paths are reconstructed only for the first
+    limit ancestors. After the deadline we return ancestors reached in
+    complete levels.
+    """
+    if search_options is None:
+        search_options = PathSearchOptions()
+    if min_datasets is None:
+        min_datasets = len(datasets)
+    hub_cap = _create_hub_cap(graph, search_options)
+    # Node -> {dataset position: parent node}.
+    reached = {}
+    level = {}
+    for label, dataset in enumerate(datasets):
+        for entry in graph.datasets[dataset]:
+            reached.setdefault(entry, {})[label] = None
+            level.setdefault(entry, set()).add(label)
+    distances = {
+        node: dict.fromkeys(labels, 0) for node, labels in level.items()
+    }
+    # Labels never stop expanding.
+    unmet = dict.fromkeys(range(len(datasets)), 1)
+    truncated = False
+    partial = False
+
+    distance = 0
+    while level:
+        if search_options.max_level is not None \
+                and distance >= search_options.max_level:
+            truncated = _can_expand(graph, level, unmet)
+            break
+        try:
+            level = _expand_labeled_level(
+                graph, reached, level, unmet, False, hub_cap,
+                search_options.deadline)
+        except _DeadlineExpired:
+            # Nodes of the interrupted level have no distance, so they
+            # are not ancestors.
+            partial = True
+            break
+        distance += 1
+        for node, labels in level.items():
+            distances.setdefault(node, {}).update(
+                dict.fromkeys(labels, distance))
+
+    ancestors = [
+        CommonAncestor(node, node_distances)
+        for node, node_distances in distances.items()
+        if len(node_distances) >= min_datasets
+    ]
+    ancestors.sort(key=lambda ancestor: (
+        -len(ancestor.distances),
+        max(ancestor.distances.values()),
+        sum(ancestor.distances.values()),
+        ancestor.node))
+    if limit is not None:
+        ancestors = ancestors[:limit]
+    for ancestor in ancestors:
+        for label in sorted(ancestor.distances):
+            ancestor.paths[label] = _reconstruct_paths(
+                lambda node: reached[node][label], ancestor.node, False)[0]
+    result = CommonAncestorsResult(ancestors, truncated)
+    if partial:
+        result.partial = True
+        result.searched_levels = distance
+    if hub_cap is not None:
+        result.cut_hubs = hub_cap.cut
+    return result
+
+
+def common_ancestors_to_output(
+        result: CommonAncestorsResult, graph: HierarchyGraph,
+        datasets: typing.List[str], metadata: typing.Dict = None,
+        vocabulary: Vocabulary = default_vocabulary):
+    """Distances and paths are given for each dataset that reached a node."""
+
+    def decode(nodes: typing.Iterable[int]) -> typing.Tuple[str]:
+        return vocabulary.decode(graph.decode(nodes))
+
+    return {
+        "metadata": {
+            **(metadata or {}),
+            "datasets": datasets,
+            "truncated": result.truncated,
+        },
+        "ancestors": [
+            {
+                "node": decode([ancestor.node])[0],
+                "datasetCount": len(ancestor.distances),
+                "distances": {
+                    datasets[label]: distance
+                    for label, distance in sorted(ancestor.distances.items())
+                },
+                "paths": {
+                    datasets[label]: decode(path)
+                    for label, path in ancestor.paths.items()
+                },
+            } for ancestor in result.ancestors
+        ],
+    }
+
+
 # endregion
 
 if __name__ == "__main__":
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Batch mode of compute_graph_similarity, compute graph-based distance
+# of every pair of datasets in a mapping collection.
+#
+# The output is a distance matrix in the layout used by
+# data-preparation/run_import_similarity.py, i.e. a CSV file without header
+# where rows and columns follow order of IRIs in the dataset title file.
+# The output name is listed in run_import_similarity.py, which makes the
+# method available in the evaluation.
+#
+# Rows are computed in parallel, each row compares one dataset with all
+# datasets after it using a single search. Finished rows are appended
+# to a progress file, so an interrupted run continues where it stopped.
+#
+# As with run_import_similarity.py, we replace missing distances (no path
+# or dataset not in collection) with the biggest distance + 1.
+#
+
+import os
+import csv
+import json
+import logging
+import multiprocessing
+import typing
+
+from compute_graph_similarity import \
+    search_paths_one_to_many, create_search_options, select_lengths, \
+    lengths_to_similarity
+from hierarchy_graph import HierarchyGraph, load_hierarchy_graph
+from ancestor_closures import get_ancestor_closures
+
+logger = logging.getLogger(__name__)
+
+# Graph used by the worker, with fork it is shared with the main process.
+_graph: typing.Optional[HierarchyGraph] = None
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(processName)-20s [%(levelname)-5s]"
+               " - %(message)s",
+        datefmt="%H:%M:%S")
+    compute_similarity_matrix(
+        # Mapping collection.
+        "../data/mapping/v1",
+        # File with pairs "iri", "title", defines order of the matrix.
+        "../data/similarities-matrix/nkod-20-title.csv",
+        # Options as for the path service.
+        {"method": "closest", "distance": 3, "engine": "multi-source"},
+        # Similarity summary used as the distance.
+        "average",
+        # Progress file.
+        "../data/working/graph-similarity/nkod-20.closest.3.jsonl",
+        # Output path.
+        "../data/similarities-matrix/nkod-20/"
+        "nkod-wikidata-mapping.graph.closest[3].average.csv"
+    )
+
+
+def compute_similarity_matrix(
+        collection_directory: str,
+        header_file: str,
+        options: typing.Dict,
+        statistic: str,
+        progress_file: str,
+        output_file: str,
+        process_count: int = None):
+    global _graph
+    iris = read_dataset_iris(header_file)
+    logger.info("Loading hierarchy graph from %s ...", collection_directory)
+    _graph = load_hierarchy_graph(collection_directory)
+    logger.info("Loading hierarchy graph ... done")
+    if options.get("engine") == "closure":
+        # Computed once, with fork the workers share the closures.
+        logger.info("Computing ancestor closures ...")
+        get_ancestor_closures(_graph).compute_datasets()
+        logger.info("Computing ancestor closures ... done")
+    iris_in_graph = [iri for iri in iris if iri in _graph.datasets]
+    logger.info(
+        "Datasets: %i, in collection: %i", len(iris), len(iris_in_graph))
+
+    rows = read_progress(progress_file)
+    tasks = [
+        (iri, iris_in_graph[index + 1:], options, statistic)
+        for index, iri in enumerate(iris_in_graph)
+        if iri not in rows
+    ]
+    logger.info("Rows done: %i, to compute: %i", len(rows), len(tasks))
+
+    os.makedirs(os.path.dirname(progress_file), exist_ok=True)
+    with open(progress_file, "a", encoding="utf-8") as stream, \
+            multiprocessing.Pool(
+                process_count,
+                initializer=_initialize_worker,
+                initargs=(collection_directory,)) as pool:
+        log_step = max(1, int(len(tasks) / 20.0))
+        for index, (iri, scores) in enumerate(
+                pool.imap_unordered(_compute_row, tasks)):
+            rows[iri] = scores
+            stream.write(json.dumps({"iri": iri, "scores": scores}) + "\n")
+            stream.flush()
+            if index % log_step == 0:
+                logger.info("  {:>5} / {}".format(index, len(tasks)))
+
+    logger.info("Writing matrix to %s ...", output_file)
+    write_matrix(output_file, iris, rows)
+    logger.info("Writing matrix ... done")
+
+
+def read_dataset_iris(path: str) -> typing.List[str]:
+    with open(path, encoding="utf-8") as stream:
+        reader = csv.reader(stream, delimiter=",", quotechar='"')
+        next(reader)
+        return [line[0] for line in reader]
+
+
+def read_progress(path: str) -> typing.Dict[str, typing.Dict[str, float]]:
+    result = {}
+    if not os.path.exists(path):
+        return result
+    with open(path, encoding="utf-8") as stream:
+        for line in stream:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                # Last line of an interrupted run.
+                continue
+            result[row["iri"]] = row["scores"]
+    return result
+
+
+def _initialize_worker(collection_directory: str):
+    global _graph
+    if _graph is None:
+        _graph = load_hierarchy_graph(collection_directory)
+
+
+def _compute_row(task) -> typing.Tuple[str, typing.Dict[str, float]]:
+    iri, candidates, options, statistic = task
+    # Only the similarity summary is needed, paths are not created.
+    searches = search_paths_one_to_many(
+        _graph, iri, candidates,
+        create_search_options({**options, "summaryOnly": True}))
+    scores = {}
+    for candidate, search in searches.items():
+        similarity = lengths_to_similarity(
+            select_lengths(search.path_lengths, options))
+        if statistic in similarity:
+            scores[candidate] = similarity[statistic]
+    return iri, scores
+
+
+def write_matrix(
+        path: str, iris: typing.List[str],
+        rows: typing.Dict[str, typing.Dict[str, float]]):
+    def distance(left: str, right: str) -> typing.Optional[float]:
+        if left == right:
+            return 0
+        value = rows.get(left, {}).get(right)
+        if value is None:
+            value = rows.get(right, {}).get(left)
+        return value
+
+    matrix = [[distance(left, right) for right in iris] for left in iris]
+    max_value = max(
+        (value for row in matrix for value in row if value is not None),
+        default=0)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8", newline="") as stream:
+        writer = csv.writer(stream, delimiter=",")
+        for row in matrix:
+            writer.writerow([
+                max_value + 1 if value is None else value
+                for value in row
+            ])
+
+
+if __name__ == "__main__":
+    multiprocessing.current_process().name = "main"
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Inverted index of hierarchy graph nodes, used to find datasets similar
+# to a query dataset without comparing all pairs.
+#
+# For every node we store the datasets whose mapped entities reach the
+# node and the distance from the closest entity. Candidates are scored
+# by nodes they share with the query:
+#
+#   score = sum over shared nodes n of
+#       log(dataset count / datasets reaching n)
+#       / (1 + query distance to n + candidate distance to n)
+#
+# so close and specific nodes count the most, nodes reached by all
+# datasets do not count at all.
+#
+
+import math
+import array
+import typing
+from dataclasses import dataclass
+
+from hierarchy_graph import \
+    HierarchyGraph, NODE_TYPE, DISTANCE_TYPE, build_csr
+
+
+@dataclass
+class SimilarDataset:
+    dataset: str
+    score: float
+    """Number of nodes reached by both the query and the dataset."""
+    shared_nodes: int
+
+
+class DatasetIndex:
+    """
+    Datasets reaching node n are datasets[offsets[n]:offsets[n + 1]],
+    given by position in iris, with distances stored in the same way.
+    Only nodes within max_distance from a dataset are indexed.
+    """
+
+    def __init__(
+            self, iris: typing.List[str], offsets: array.array,
+            datasets: array.array, distances: array.array,
+            max_distance: int):
+        self.iris = iris
+        self.offsets = offsets
+        self.datasets = datasets
+        self.distances = distances
+        self.max_distance = max_distance
+        self._positions = {
+            iri: position for position, iri in enumerate(iris)
+        }
+
+    @staticmethod
+    def build(graph: HierarchyGraph, max_distance: int) -> "DatasetIndex":
+        iris = sorted(graph.datasets.keys())
+        reached = [
+            graph.distances(graph.datasets[iri], max_distance)
+            for iri in iris
+        ]
+        offsets, (datasets, distances) = build_csr(
+            len(graph), lambda: (
+                (node, position, distance)
+                for position, dataset_reached in enumerate(reached)
+                for node, distance in dataset_reached.items()
+            ), [NODE_TYPE, DISTANCE_TYPE])
+        return DatasetIndex(iris, offsets, datasets, distances, max_distance)
+
+    def search(
+            self, graph: HierarchyGraph, query: str, limit: int = 10,
+            max_distance: typing.Optional[int] = None) \
+            -> typing.List[SimilarDataset]:
+        """
+        Return datasets with the highest score, the query must be part of
+        the graph. Distance is limited by max_distance of the index.
+        """
+        if max_distance is None or max_distance > self.max_distance:
+            max_distance = self.max_distance
+        dataset_count = len(self.iris)
+        scores = {}
+        shared = {}
+        query_reached = graph.distances(graph.datasets[query], max_distance)
+        for node, query_distance in query_reached.items():
+            start, end = self.offsets[node], self.offsets[node + 1]
+            if start == end:
+                continue
+            weight = math.log(dataset_count / (end - start))
+            if weight == 0:
+                continue
+            for dataset, distance in zip(
+                    self.datasets[start:end], self.distances[start:end]):
+                if distance > max_distance:
+                    continue
+                scores[dataset] = scores.get(dataset, 0) \
+                    + weight / (1 + query_distance + distance)
+                shared[dataset] = shared.get(dataset, 0) + 1
+        query_position = self._positions[query]
+        result = [
+            SimilarDataset(self.iris[dataset], score, shared[dataset])
+            for dataset, score in scores.items()
+            if dataset != query_position
+        ]
+        result.sort(key=lambda item: (-item.score, item.dataset))
+        return result[:limit]
+
+    def statistics(self) -> typing.Dict[str, int]:
+        return {
+            "datasets": len(self.iris),
+            "postings": len(self.datasets),
+            "maxDistance": self.max_distance,
+        }
+
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Load mapped datasets from the data directory, so clients can refer to
+# datasets instead of uploading them. Datasets are stored in
+# <data>/mapping/<collection>/<file name>.json, where the file name is
+# given by <data>/dataset-iri-to-file-name.json .
+#
+
+import os
+import json
+import functools
+import typing
+
+from compute_graph_similarity import Dataset, load_dataset_from_json
+
+
+class DatasetStore:
+    """Load datasets by IRI or file name, keep recently used in memory."""
+
+    def __init__(self, data_directory: str, capacity: int = 128):
+        self._mapping_directory = os.path.join(data_directory, "mapping")
+        self._iri_to_file_name = {}
+        iri_to_file_name_file = os.path.join(
+            data_directory, "dataset-iri-to-file-name.json")
+        if os.path.exists(iri_to_file_name_file):
+            with open(iri_to_file_name_file, encoding="utf-8") as stream:
+                self._iri_to_file_name = json.load(stream)
+        self._load = functools.lru_cache(maxsize=capacity)(self._load_file)
+        self._versions = {}
+
+    def collections(self) -> typing.List[str]:
+        return sorted(
+            item.name for item in os.scandir(self._mapping_directory)
+            if item.is_dir())
+
+    def get(self, collection: str, dataset: str) -> Dataset:
+        """Raise KeyError for unknown collection or dataset."""
+        if collection not in self.collections():
+            raise KeyError("Unknown collection: {}".format(collection))
+        file_name = self._file_name(dataset)
+        path = os.path.join(
+            self._mapping_directory, collection, file_name + ".json")
+        if not os.path.exists(path):
+            raise KeyError("Unknown dataset: " + dataset)
+        return self._load(collection, file_name)
+
+    def version(self, collection: str) -> str:
+        """
+        Fingerprint of collection files computed on first use, as are the
+        cached datasets the collection is expected not to change while
+        the service is running.
+        """
+        if collection not in self._versions:
+            if collection not in self.collections():
+                raise KeyError("Unknown collection: {}".format(collection))
+            files = [
+                item.stat() for item in os.scandir(
+                    os.path.join(self._mapping_directory, collection))
+                if item.name.endswith(".json")
+            ]
+            self._versions[collection] = "{}-{}".format(
+                len(files),
+                max((item.st_mtime_ns for item in files), default=0))
+        return self._versions[collection]
+
+    def _file_name(self, dataset: str) -> str:
+        if dataset in self._iri_to_file_name:
+            return self._iri_to_file_name[dataset]
+        if dataset.endswith(".json"):
+            dataset = dataset[:-len(".json")]
+        if os.path.basename(dataset) != dataset or dataset.startswith("."):
+            raise KeyError("Invalid dataset: " + dataset)
+        return dataset
+
+    def _load_file(self, collection: str, file_name: str) -> Dataset:
+        path = os.path.join(
+            self._mapping_directory, collection, file_name + ".json")
+        with open(path, encoding="utf-8") as stream:
+            return load_dataset_from_json(json.load(stream))
+
+    def statistics(self) -> typing.Dict[str, int]:
+        info = self._load.cache_info()
+        return {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "capacity": info.maxsize,
+        }
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Binary snapshot of the hierarchy graph of a mapping collection, so the
+# service does not need to parse all mapping files at startup.
+#
+# The snapshot stores the vocabulary with a hash table used to find
+# values, the graph arrays and entities of each dataset. The file starts
+# with MAGIC, length of the JSON header and the header, sections follow
+# aligned to 8 bytes. Arrays are stored in native byte order and used
+# directly from the memory mapped file.
+#
+# When the snapshot is loaded into an empty vocabulary, the vocabulary
+# and the graph use the file without copying, so worker processes share
+# the memory through the page cache.
+#
+# The header contains fingerprint of the collection files, a snapshot
+# with different fingerprint, format version or byte order is rebuilt.
+#
+# Usage:
+#   python graph_snapshot.py <collection directory> <snapshot file>
+#
+
+import os
+import sys
+import json
+import mmap
+import array
+import struct
+import logging
+import typing
+
+from hierarchy_graph import \
+    HierarchyGraph, OFFSET_TYPE, NODE_TYPE, load_hierarchy_graph
+from vocabulary import Vocabulary, SharedValues, default_vocabulary
+
+MAGIC = b"ODINSNAP"
+
+FORMAT_VERSION = 3
+
+ALIGNMENT = 8
+
+# Header length is stored as unsigned 64-bit integer.
+HEADER_LENGTH = struct.Struct("<Q")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    directory, path = sys.argv[1:3]
+    graph = load_hierarchy_graph(directory)
+    write_snapshot(path, graph, collection_fingerprint(directory))
+    logging.info("Snapshot stored to %s", path)
+
+
+def collection_fingerprint(directory: str) -> str:
+    """Change of any mapping file changes the fingerprint."""
+    files = [
+        item.stat() for item in os.scandir(directory)
+        if item.name.endswith(".json")
+    ]
+    return "{}-{}-{}".format(
+        len(files),
+        max((item.st_mtime_ns for item in files), default=0),
+        sum(item.st_size for item in files))
+
+
+def write_snapshot(
+        path: str, graph: HierarchyGraph, fingerprint: str,
+        vocabulary: Vocabulary = default_vocabulary):
+    """
+    Store the graph with the whole vocabulary. The file is replaced at
+    once, so running services never read a partial snapshot.
+    """
+    values = [
+        value.encode("utf-8")
+        for value in vocabulary.decode(range(len(vocabulary)))
+    ]
+    value_offsets = array.array(OFFSET_TYPE, [0])
+    for value in values:
+        value_offsets.append(value_offsets[-1] + len(value))
+    dataset_ranges = []
+    entities = bytearray()
+    position = 0
+    for iri, dataset_entities in graph.datasets.items():
+        end = position + len(dataset_entities)
+        dataset_ranges.append([iri, position, end])
+        entities += _to_bytes(dataset_entities, NODE_TYPE)
+        position = end
+    sections = {
+        "vocabulary": b"".join(values),
+        "vocabularyOffsets": value_offsets.tobytes(),
+        "vocabularyTable": _to_bytes(
+            SharedValues.build_table(values), NODE_TYPE),
+        "nodes": _to_bytes(graph.nodes, NODE_TYPE),
+        "offsets": _to_bytes(graph.offsets, OFFSET_TYPE),
+        "targets": _to_bytes(graph.targets, NODE_TYPE),
+        "entities": bytes(entities),
+    }
+    header = {
+        "version": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "fingerprint": fingerprint,
+        "vocabularySize": len(values),
+        "datasets": dataset_ranges,
+        "sections": {},
+    }
+    # Section positions are relative to the end of the header.
+    position = 0
+    for name, content in sections.items():
+        header["sections"][name] = [position, len(content)]
+        position = _align(position + len(content))
+    header_bytes = _align_bytes(
+        json.dumps(header).encode("utf-8"),
+        len(MAGIC) + HEADER_LENGTH.size)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as stream:
+        stream.write(MAGIC)
+        stream.write(HEADER_LENGTH.pack(len(header_bytes)))
+        stream.write(header_bytes)
+        for content in sections.values():
+            stream.write(_align_bytes(content))
+    os.replace(temporary_path, path)
+
+
+def load_snapshot(
+        path: str, fingerprint: str,
+        vocabulary: Vocabulary = default_vocabulary) \
+        -> typing.Optional[HierarchyGraph]:
+    """
+    Return graph with arrays backed by the memory mapped file, or None
+    when the snapshot is missing or outdated. An empty vocabulary uses
+    values of the snapshot, otherwise the values are added to the
+    vocabulary and graph nodes are translated.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as stream:
+        # The mapping stays open after the file is closed.
+        content = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    if content[:len(MAGIC)] != MAGIC:
+        return None
+    header_start = len(MAGIC) + HEADER_LENGTH.size
+    header_length, = HEADER_LENGTH.unpack_from(content, len(MAGIC))
+    header = json.loads(content[header_start:header_start + header_length])
+    if header["version"] != FORMAT_VERSION \
+            or header["byteorder"] != sys.byteorder \
+            or header["fingerprint"] != fingerprint:
+        return None
+    buffer = memoryview(content)
+    sections_start = header_start + header_length
+
+    def section(name: str) -> memoryview:
+        start, length = header["sections"][name]
+        start += sections_start
+        return buffer[start:start + length]
+
+    values = SharedValues(
+        section("vocabulary"), section("vocabularyOffsets").cast(OFFSET_TYPE),
+        section("vocabularyTable").cast(NODE_TYPE))
+    nodes = section("nodes").cast(NODE_TYPE)
+    if len(vocabulary) == 0:
+        vocabulary.attach(values)
+    else:
+        ids = vocabulary.intern_all(
+            values[node] for node in range(len(values)))
+        nodes = [ids[node] for node in nodes]
+    entities = section("entities").cast(NODE_TYPE)
+    datasets = {
+        iri: entities[start:end]
+        for iri, start, end in header["datasets"]
+    }
+    return HierarchyGraph(
+        nodes, section("offsets").cast(OFFSET_TYPE),
+        section("targets").cast(NODE_TYPE), datasets)
+
+
+def load_hierarchy_graph_with_snapshot(
+        directory: str, path: str,
+        vocabulary: Vocabulary = default_vocabulary) -> HierarchyGraph:
+    """
+    Load graph from the snapshot, build it from the collection directory
+    and store the snapshot when it is missing or outdated.
+    """
+    fingerprint = collection_fingerprint(directory)
+    graph = load_snapshot(path, fingerprint, vocabulary)
+    if graph is not None:
+        return graph
+    logging.info("Snapshot %s is missing or outdated.", path)
+    graph = load_hierarchy_graph(directory, vocabulary)
+    write_snapshot(path, graph, fingerprint, vocabulary)
+    return graph
+
+
+def _to_bytes(values: typing.Sequence[int], type_code: str) -> bytes:
+    """Values are a list, an array or a memory view of given type."""
+    if isinstance(values, list):
+        values = array.array(type_code, values)
+    return values.tobytes()
+
+
+def _align(position: int) -> int:
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _align_bytes(content: bytes, start: int = 0) -> bytes:
+    """Pad content so it ends aligned, given it is stored at start."""
+    end = start + len(content)
+    return content + b" " * (_align(end) - end)
+
+
+if __name__ == "__main__":
+    main()
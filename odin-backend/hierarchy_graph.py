@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Compact, read-only representation of the Wikidata hierarchy
+# (instanceof and subclassof edges) used by the dataset mappings.
+#
+# The graph is stored in compressed sparse row (CSR) layout. Every node
+# has an integer ID, the targets of node n are stored in
+# targets[offsets[n]:offsets[n + 1]]. Graph node IDs are local to the
+# graph, the nodes themselves are vocabulary IDs.
+#
+# Indexes built from the graph use the same CSR layout, see build_csr,
+# and the same breadth first search, see breadth_first_search.
+#
+
+import os
+import json
+import array
+import typing
+import itertools
+
+from vocabulary import Vocabulary, default_vocabulary
+
+# We use signed 64-bit integers for offsets and 32-bit for node IDs.
+OFFSET_TYPE = "q"
+NODE_TYPE = "i"
+
+# Distances are small, -1 is used for unreachable nodes.
+DISTANCE_TYPE = "h"
+
+
+class Hierarchy:
+    """
+    Hierarchy entries (source, type, target) stored as parallel arrays
+    of vocabulary IDs, iteration yields the entries as tuples.
+    """
+
+    __slots__ = ("sources", "types", "targets")
+
+    def __init__(
+            self, sources: array.array, types: array.array,
+            targets: array.array):
+        self.sources = sources
+        self.types = types
+        self.targets = targets
+
+    @staticmethod
+    def from_entries(
+            entries: typing.Iterable[typing.Sequence[str]],
+            vocabulary: Vocabulary = default_vocabulary) -> "Hierarchy":
+        result = Hierarchy(
+            array.array(NODE_TYPE), array.array(NODE_TYPE),
+            array.array(NODE_TYPE))
+        intern = vocabulary.intern
+        for source, entry_type, target in entries:
+            result.sources.append(intern(source))
+            result.types.append(intern(entry_type))
+            result.targets.append(intern(target))
+        return result
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __iter__(self):
+        return zip(self.sources, self.types, self.targets)
+
+
+class HierarchyGraph:
+    """
+    Nodes are vocabulary IDs, position in nodes is the node ID. Datasets
+    are the datasets the graph was built from, given by IRI, with IDs of
+    their mapped entities. Arrays of a graph loaded from a snapshot are
+    memory views of the snapshot file.
+    """
+
+    def __init__(
+            self, nodes: typing.List[int],
+            offsets: array.array, targets: array.array,
+            datasets: typing.Dict[str, array.array] = None):
+        self.nodes = nodes
+        # Node IDs by vocabulary ID, built on first use.
+        self._index = None
+        self.offsets = offsets
+        self.targets = targets
+        self.datasets = datasets or {}
+        self._in_degrees = None
+        self._entity_in_degrees = None
+
+    @staticmethod
+    def from_hierarchies(
+            hierarchies: typing.Iterable[typing.Iterable],
+            entities: typing.Iterable[int] = (),
+            datasets: typing.Dict[str, typing.Iterable[int]] = None) \
+            -> "HierarchyGraph":
+        """
+        Build graph from hierarchy entries (source, type, target). Entities,
+        including those of the datasets, are added as nodes even when they
+        have no edges.
+        """
+        index = {}
+        nodes = []
+
+        def node_id(node: int) -> int:
+            result = index.get(node)
+            if result is None:
+                result = len(nodes)
+                index[node] = result
+                nodes.append(node)
+            return result
+
+        edges = {
+            (node_id(entry[0]), node_id(entry[2]))
+            for entry in itertools.chain(*hierarchies)
+        }
+        for entity in entities:
+            node_id(entity)
+        dataset_entities = {
+            iri: array.array(NODE_TYPE, sorted({
+                node_id(entity) for entity in dataset_entities
+            }))
+            for iri, dataset_entities in (datasets or {}).items()
+        }
+
+        offsets, (targets,) = build_csr(
+            len(nodes), lambda: sorted(edges), [NODE_TYPE])
+        return HierarchyGraph(nodes, offsets, targets, dataset_entities)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def edge_count(self) -> int:
+        return len(self.targets)
+
+    def in_degrees(self) -> array.array:
+        """
+        Return number of incoming edges of each node, i.e. how generic the
+        node is. Computed on first use.
+        """
+        if self._in_degrees is None:
+            degrees = array.array(NODE_TYPE, [0] * len(self.nodes))
+            for target in self.targets:
+                degrees[target] += 1
+            self._in_degrees = degrees
+        return self._in_degrees
+
+    def entity_in_degrees(self) -> array.array:
+        """
+        Return in_degrees indexed by vocabulary ID, -1 for vocabulary IDs
+        not in the graph. Computed on first use.
+        """
+        if self._entity_in_degrees is None:
+            degrees = self.in_degrees()
+            result = array.array(
+                NODE_TYPE, [-1] * (max(self.nodes, default=-1) + 1))
+            for position, node in enumerate(self.nodes):
+                result[node] = degrees[position]
+            self._entity_in_degrees = result
+        return self._entity_in_degrees
+
+    def get(self, node: int, default=()) -> typing.Sequence[int]:
+        """Return targets of given node, compatible with dict.get."""
+        if 0 <= node < len(self.nodes):
+            return self.targets[self.offsets[node]:self.offsets[node + 1]]
+        return default
+
+    def distances(
+            self, entities: typing.Iterable[int],
+            max_distance: typing.Optional[int] = None) \
+            -> typing.Dict[int, int]:
+        """
+        Return nodes reachable from the entities, including the entities,
+        with the minimal distance. Only nodes within max_distance are
+        returned unless it is None.
+        """
+        nodes, offsets, _ = breadth_first_search(
+            entities, self.get, max_distance)
+        return {
+            node: distance
+            for distance in range(len(offsets) - 1)
+            for node in nodes[offsets[distance]:offsets[distance + 1]]
+        }
+
+    def encode(self, entities: typing.Iterable[int]) -> typing.List[int]:
+        """Convert vocabulary IDs to graph node IDs."""
+        if self._index is None:
+            self._index = {
+                node: position for position, node in enumerate(self.nodes)
+            }
+        return [self._index[entity] for entity in entities]
+
+    def decode(self, nodes: typing.Iterable[int]) -> typing.Tuple[int]:
+        """Convert graph node IDs to vocabulary IDs."""
+        return tuple(self.nodes[node] for node in nodes)
+
+    def covers(self, *datasets) -> bool:
+        """
+        True if all given datasets were used to build the graph. Datasets
+        are compared by IRI only, mappings and hierarchy are not checked.
+        """
+        return all(dataset.id in self.datasets for dataset in datasets)
+
+
+def build_csr(
+        row_count: int,
+        items: typing.Callable[[], typing.Iterable[typing.Sequence[int]]],
+        value_types: typing.List[str]) \
+        -> typing.Tuple[array.array, typing.List[array.array]]:
+    """
+    Return offsets and value arrays in CSR layout, values of row r are
+    stored in values[offsets[r]:offsets[r + 1]] in order of the items.
+    Items are (row, value, ...) with a value for each of value types,
+    items is called twice, to count and to fill the rows.
+    """
+    offsets = array.array(OFFSET_TYPE, [0] * (row_count + 1))
+    for item in items():
+        offsets[item[0] + 1] += 1
+    for position in range(row_count):
+        offsets[position + 1] += offsets[position]
+    values = [
+        array.array(value_type, [0] * offsets[-1])
+        for value_type in value_types
+    ]
+    fill = array.array(OFFSET_TYPE, offsets[:-1])
+    for row, *item_values in items():
+        for column, value in zip(values, item_values):
+            column[fill[row]] = value
+        fill[row] += 1
+    return offsets, values
+
+
+def breadth_first_search(
+        starts: typing.Iterable[int],
+        neighbours: typing.Callable[[int], typing.Iterable[int]],
+        max_distance: typing.Optional[int] = None) \
+        -> typing.Tuple[array.array, array.array, array.array]:
+    """
+    Return nodes reachable from the starts, offsets and parents. Nodes
+    are ordered by the minimal distance, nodes with distance d are
+    stored in nodes[offsets[d]:offsets[d + 1]]. Parent of a node is the
+    smallest node in the previous level with an edge to the node, -1 for
+    the starts. Only nodes within max_distance are returned unless it is
+    None.
+    """
+    # Node -> position in nodes.
+    positions = {}
+    nodes = array.array(NODE_TYPE)
+    for node in starts:
+        if node not in positions:
+            positions[node] = len(nodes)
+            nodes.append(node)
+    parents = array.array(NODE_TYPE, [-1] * len(nodes))
+    offsets = array.array(NODE_TYPE, [0])
+    if nodes:
+        offsets.append(len(nodes))
+    start = 0
+    while start < len(nodes) \
+            and (max_distance is None or len(offsets) - 2 < max_distance):
+        end = len(nodes)
+        for source in nodes[start:end]:
+            for target in neighbours(source):
+                position = positions.get(target)
+                if position is None:
+                    positions[target] = len(nodes)
+                    nodes.append(target)
+                    parents.append(source)
+                elif position >= end and source < parents[position]:
+                    # Another parent in the same level.
+                    parents[position] = source
+        if len(nodes) > end:
+            offsets.append(len(nodes))
+        start = end
+    return nodes, offsets, parents
+
+
+def load_hierarchy_graph(
+        directory: str, vocabulary: Vocabulary = default_vocabulary) \
+        -> HierarchyGraph:
+    """Build graph from all mapping files in given collection directory."""
+    hierarchies = []
+    datasets = {}
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(".json"):
+            continue
+        with open(os.path.join(directory, file_name), encoding="utf-8") \
+                as stream:
+            content = json.load(stream)
+        hierarchies.append(
+            Hierarchy.from_entries(content["hierarchy"], vocabulary))
+        datasets[content["@id"]] = [
+            vocabulary.intern(data_item["id"])
+            for mapping in content["mappings"]
+            for data_item in mapping["data"]
+        ]
+    return HierarchyGraph.from_hierarchies(hierarchies, datasets=datasets)
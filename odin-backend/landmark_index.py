@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Landmark index of a hierarchy graph, used to bound length of the
+# shortest path between two entities without a graph search.
+#
+# Landmarks are nodes close above the most mapped entities, selected
+# greedily: each landmark covers entities within COVER_DISTANCE below it
+# not covered by the previous landmarks. For each landmark we store, for
+# every node, the distance up to the landmark and the distance in the
+# graph with edges used in both directions.
+#
+# Paths connect two entities through a shared node s reached in the
+# meeting level k = max(left distance, right distance) and have length
+# left distance + right distance - 1. The bounds are:
+#  * lower, the undirected distance of the entities is at most the sum
+#    of distances to s and at least the difference of their undirected
+#    distances to a landmark
+#  * upper, a landmark above both entities is a candidate shared node,
+#    so k is at most the bigger of their distances to the landmark. If
+#    k is equal, the landmark is a shared node, otherwise the path is no
+#    longer than 2 * (k - 1) - 1.
+#
+# Bounds to the closest entity of a set use distances of the set to each
+# landmark: the upper bound grows with distance of the other entity, so
+# the closest one to the landmark gives the smallest of the pair bounds.
+# The lower bound uses the closest undirected distance for each landmark
+# on its own, so it is weaker than the smallest of the pair bounds. The
+# closest distances are tabulated for every distance to the landmark, so
+# a bound costs one lookup for each landmark.
+#
+
+import math
+import heapq
+import array
+import typing
+import itertools
+
+from hierarchy_graph import HierarchyGraph, NODE_TYPE, DISTANCE_TYPE, \
+    build_csr, breadth_first_search
+
+# Distance of entities below a landmark covered by the landmark.
+COVER_DISTANCE = 2
+
+
+class LandmarkTargets:
+    """
+    Distances of a set of entities to each landmark: the smallest upward
+    distance, None if no entity is below the landmark, difference to the
+    closest undirected distance by undirected distance of a node, None if
+    no entity is connected, and true if some entity is not connected to
+    the landmark.
+    """
+
+    __slots__ = ("entities", "upward", "gaps", "disconnected")
+
+    def __init__(
+            self, entities: typing.Set[int],
+            upward: typing.List[typing.Optional[int]],
+            gaps: typing.List[typing.Optional[typing.List[int]]],
+            disconnected: typing.List[bool]):
+        self.entities = entities
+        self.upward = upward
+        self.gaps = gaps
+        self.disconnected = disconnected
+
+
+class LandmarkIndex:
+
+    def __init__(
+            self, landmarks: typing.List[int],
+            upward: typing.List[array.array],
+            undirected: typing.List[array.array]):
+        self.landmarks = landmarks
+        self.upward = upward
+        self.undirected = undirected
+        self._depths = [max(distances, default=-1) for distances in undirected]
+
+    @staticmethod
+    def build(
+            graph: HierarchyGraph, landmark_count: int,
+            entities: typing.Optional[typing.Iterable[int]] = None) \
+            -> "LandmarkIndex":
+        """
+        Landmarks cover entities of all datasets of the graph unless the
+        entities are given. When all entities are covered, the remaining
+        landmarks are the nodes with the most incoming edges.
+        """
+        offsets, sources = _incoming_edges(graph)
+        if entities is None:
+            entities = itertools.chain(*graph.datasets.values())
+        landmarks = _cover_entities(graph, set(entities), landmark_count)
+        in_degrees = [
+            offsets[node + 1] - offsets[node] for node in range(len(graph))
+        ]
+        selected = set(landmarks)
+        landmarks += [
+            node for node in sorted(
+                range(len(graph)),
+                key=lambda node: (-in_degrees[node], node))
+            if node not in selected
+        ][:landmark_count - len(landmarks)]
+
+        def incoming(node: int):
+            return sources[offsets[node]:offsets[node + 1]]
+
+        def both(node: int):
+            return [*graph.get(node), *incoming(node)]
+
+        return LandmarkIndex(
+            landmarks,
+            [_distances(len(graph), node, incoming) for node in landmarks],
+            [_distances(len(graph), node, both) for node in landmarks])
+
+    def targets(self, entities: typing.Iterable[int]) -> LandmarkTargets:
+        entities = set(entities)
+        upward = []
+        gaps = []
+        disconnected = []
+        for landmark_upward, landmark_undirected, depth in zip(
+                self.upward, self.undirected, self._depths):
+            distances = [
+                landmark_upward[entity] for entity in entities
+                if landmark_upward[entity] >= 0
+            ]
+            upward.append(min(distances, default=None))
+            distances = [landmark_undirected[entity] for entity in entities]
+            gaps.append(_closest_gaps(
+                [distance for distance in distances if distance >= 0],
+                depth))
+            disconnected.append(any(distance < 0 for distance in distances))
+        return LandmarkTargets(entities, upward, gaps, disconnected)
+
+    def bounds(self, entity: int, targets: LandmarkTargets) \
+            -> typing.Tuple[float, float]:
+        """
+        Return lower and upper bound of length of the shortest path from
+        the entity to the targets. Upper bound is infinite when no landmark
+        is above the entity and a target, both are infinite when the entity
+        is not connected to any target.
+        """
+        if entity in targets.entities:
+            return 0, 0
+        lower = 0
+        upper = math.inf
+        for upward, undirected, target_upward, gaps, disconnected in zip(
+                self.upward, self.undirected, targets.upward,
+                targets.gaps, targets.disconnected):
+            distance = undirected[entity]
+            if distance < 0:
+                if not disconnected:
+                    # All targets are in another component.
+                    return math.inf, math.inf
+                continue
+            if gaps is None:
+                return math.inf, math.inf
+            lower = max(lower, gaps[distance] - 1)
+            distance = upward[entity]
+            if distance < 0 or target_upward is None:
+                continue
+            level = max(distance, target_upward)
+            upper = min(
+                upper, max(distance + target_upward - 1, 2 * level - 3))
+        return lower, upper
+
+    def statistics(self) -> typing.Dict[str, int]:
+        return {
+            "landmarks": len(self.landmarks),
+            "nodes": len(self.upward[0]) if self.upward else 0,
+        }
+
+
+def _cover_entities(
+        graph: HierarchyGraph, entities: typing.Set[int], count: int) \
+        -> typing.List[int]:
+    """
+    Return up to count nodes, each covering the most entities within
+    COVER_DISTANCE below it not covered by the previous nodes.
+    """
+    covers = {}
+    for entity in entities:
+        for node in graph.distances([entity], COVER_DISTANCE):
+            covers.setdefault(node, []).append(entity)
+    # Number of covered entities only decreases, so a node is selected
+    # when its updated number is still the biggest.
+    candidates = [(-len(covered), node) for node, covered in covers.items()]
+    heapq.heapify(candidates)
+    covered = set()
+    result = []
+    while candidates and len(result) < count:
+        size, node = heapq.heappop(candidates)
+        new_size = sum(1 for entity in covers[node] if entity not in covered)
+        if new_size == 0:
+            continue
+        if new_size < -size:
+            heapq.heappush(candidates, (-new_size, node))
+            continue
+        result.append(node)
+        covered.update(covers[node])
+    return result
+
+
+def _closest_gaps(distances: typing.List[int], depth: int) \
+        -> typing.Optional[typing.List[int]]:
+    """
+    Return difference to the closest of the distances for each distance
+    up to depth, None without distances.
+    """
+    if not distances:
+        return None
+    result = [math.inf] * (depth + 1)
+    for distance in distances:
+        result[distance] = 0
+    for distance in range(1, depth + 1):
+        result[distance] = min(result[distance], result[distance - 1] + 1)
+    for distance in reversed(range(depth)):
+        result[distance] = min(result[distance], result[distance + 1] + 1)
+    return result
+
+
+def _incoming_edges(graph: HierarchyGraph) \
+        -> typing.Tuple[array.array, array.array]:
+    """Return graph with reversed edges in CSR layout."""
+    offsets, (sources,) = build_csr(
+        len(graph), lambda: (
+            (target, source)
+            for source in range(len(graph))
+            for target in graph.get(source)
+        ), [NODE_TYPE])
+    return offsets, sources
+
+
+def _distances(
+        node_count: int, start: int,
+        neighbours: typing.Callable[[int], typing.Iterable[int]]) \
+        -> array.array:
+    result = array.array(DISTANCE_TYPE, [-1] * node_count)
+    nodes, offsets, _ = breadth_first_search([start], neighbours)
+    for distance in range(len(offsets) - 1):
+        for node in nodes[offsets[distance]:offsets[distance + 1]]:
+            result[node] = distance
+    return result
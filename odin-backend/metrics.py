@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Timing of request processing stages and aggregated service metrics.
+#
+
+import time
+import bisect
+import threading
+import collections
+import contextlib
+import typing
+
+# Upper bounds of latency histogram buckets in seconds.
+LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+# Number of most requested datasets to report.
+TOP_DATASETS = 20
+
+
+class StageTimer:
+    """Collect durations of named stages and counts of processed items."""
+
+    def __init__(self):
+        self.durations: typing.Dict[str, float] = {}
+        self.counts: typing.Dict[str, int] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = \
+                self.durations.get(name, 0) + time.perf_counter() - start
+
+    def to_json(self):
+        return {
+            "stages": self.durations,
+            "counts": self.counts,
+        }
+
+
+class _MethodMetrics:
+
+    def __init__(self):
+        self.requests = 0
+        # Last bucket is for values bigger than the last bound.
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0
+        self.stages = collections.defaultdict(float)
+        self.computations = 0
+        self.counts = collections.defaultdict(int)
+
+
+class Metrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._methods = collections.defaultdict(_MethodMetrics)
+        self._datasets = collections.Counter()
+
+    def record_request(
+            self, method: str, latency: float,
+            datasets: typing.Iterable[str] = (),
+            stages: typing.Dict[str, float] = None):
+        """Stages are those measured for every request, not computation."""
+        with self._lock:
+            metrics = self._methods[method]
+            metrics.requests += 1
+            metrics.latency_sum += latency
+            metrics.latency_buckets[
+                bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+            for name, value in (stages or {}).items():
+                metrics.stages[name] += value
+            self._datasets.update(datasets)
+
+    def record_computation(self, method: str, statistics: typing.Dict):
+        """Record statistics as produced by StageTimer.to_json ."""
+        with self._lock:
+            metrics = self._methods[method]
+            metrics.computations += 1
+            for name, value in statistics["stages"].items():
+                metrics.stages[name] += value
+            for name, value in statistics["counts"].items():
+                metrics.counts[name] += value
+
+    def to_json(self):
+        with self._lock:
+            return {
+                "methods": {
+                    method: _method_to_json(metrics)
+                    for method, metrics in self._methods.items()
+                },
+                "datasets": [
+                    {"dataset": dataset, "requests": count}
+                    for dataset, count
+                    in self._datasets.most_common(TOP_DATASETS)
+                ],
+            }
+
+
+def _method_to_json(metrics: _MethodMetrics):
+    # Histogram buckets are cumulative, as in Prometheus.
+    buckets = {}
+    total = 0
+    for bound, count in zip(
+            [*LATENCY_BUCKETS, "+Inf"], metrics.latency_buckets):
+        total += count
+        buckets[str(bound)] = total
+    return {
+        "requests": metrics.requests,
+        "latency": {
+            "buckets": buckets,
+            "sum": metrics.latency_sum,
+        },
+        "computations": metrics.computations,
+        "stagesSum": dict(metrics.stages),
+        "countsSum": dict(metrics.counts),
+    }
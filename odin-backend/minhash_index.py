@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# MinHash signatures of datasets with locality sensitive hashing, used to
+# find datasets with similar ancestor sets without comparing all pairs.
+#
+# The ancestor set of a dataset contains the mapped entities and all
+# nodes reachable from them. Similarity of two datasets is the Jaccard
+# index of their ancestor sets, estimated as the ratio of equal values
+# in their signatures.
+#
+# Signatures use one permutation hashing: every node is hashed once, the
+# hash selects a bucket and the bucket keeps the minimal value. Empty
+# buckets borrow the value of the closest non-empty bucket to the right,
+# increased by the distance, so a signature costs one pass over the set.
+#
+# Signatures are split to bands, datasets with all values of a band equal
+# are candidates. With b bands of r values a pair with similarity s is a
+# candidate with probability 1 - (1 - s^r)^b.
+#
+
+import array
+import typing
+from dataclasses import dataclass
+
+from hierarchy_graph import HierarchyGraph
+
+SIGNATURE_TYPE = "Q"
+
+HASH_MASK = (1 << 64) - 1
+
+# Value of buckets of an empty set.
+EMPTY = HASH_MASK
+
+
+@dataclass
+class Neighbour:
+    dataset: str
+    """Estimated Jaccard index of the ancestor sets."""
+    similarity: float
+
+
+class MinHashIndex:
+    """
+    Signature of dataset iris[p] is signatures[p * size:(p + 1) * size].
+    Each band maps hash of its values to positions of datasets.
+    """
+
+    def __init__(
+            self, iris: typing.List[str], signatures: array.array,
+            size: int, band_count: int, seed: int = 0):
+        if band_count < 1 or size % band_count != 0:
+            raise ValueError(
+                "Signature size must be a multiple of the band count.")
+        self.iris = iris
+        self.signatures = signatures
+        self.size = size
+        self.band_count = band_count
+        self.seed = seed
+        self._positions = {
+            iri: position for position, iri in enumerate(iris)
+        }
+        self._bands = [{} for _ in range(band_count)]
+        for position in range(len(iris)):
+            self._add_to_bands(position)
+
+    @staticmethod
+    def build(
+            graph: HierarchyGraph, size: int, band_count: int,
+            seed: int = 0) -> "MinHashIndex":
+        iris = sorted(graph.datasets.keys())
+        # Ancestor sets overlap, each node is hashed only once.
+        hashes = array.array(
+            SIGNATURE_TYPE, [_hash(node, seed) for node in range(len(graph))])
+        signatures = array.array(SIGNATURE_TYPE)
+        for iri in iris:
+            ancestors = graph.distances(graph.datasets[iri]).keys()
+            signatures.extend(compute_signature(
+                [hashes[node] for node in ancestors], size))
+        return MinHashIndex(iris, signatures, size, band_count, seed)
+
+    def signature(self, dataset: str) -> typing.Sequence[int]:
+        start = self._positions[dataset] * self.size
+        return self.signatures[start:start + self.size]
+
+    def similarity(self, left: str, right: str) -> float:
+        return estimate_jaccard(self.signature(left), self.signature(right))
+
+    def neighbours(
+            self, query: str, limit: int = 10, min_similarity: float = 0) \
+            -> typing.List[Neighbour]:
+        """
+        Return candidates of the bands with the highest estimated
+        similarity, the query must be part of the index.
+        """
+        query_position = self._positions[query]
+        query_signature = self.signature(query)
+        candidates = set()
+        for band, key in enumerate(self._band_keys(query_position)):
+            if key is not None:
+                candidates.update(self._bands[band].get(key, ()))
+        candidates.discard(query_position)
+        result = []
+        for position in candidates:
+            similarity = estimate_jaccard(
+                query_signature, self.signature(self.iris[position]))
+            if similarity >= min_similarity:
+                result.append(Neighbour(self.iris[position], similarity))
+        result.sort(key=lambda item: (-item.similarity, item.dataset))
+        return result[:limit]
+
+    def statistics(self) -> typing.Dict[str, int]:
+        return {
+            "datasets": len(self.iris),
+            "signatureSize": self.size,
+            "bands": self.band_count,
+            "buckets": sum(len(band) for band in self._bands),
+        }
+
+    def _band_keys(self, position: int) -> typing.List[typing.Optional[int]]:
+        """Return key of each band, None for datasets without nodes."""
+        values = self.signature(self.iris[position])
+        if values[0] == EMPTY:
+            return [None] * self.band_count
+        rows = self.size // self.band_count
+        # Colliding keys only add candidates, they are checked by the
+        # estimated similarity.
+        return [
+            hash(tuple(values[start:start + rows]))
+            for start in range(0, self.size, rows)
+        ]
+
+    def _add_to_bands(self, position: int):
+        for band, key in enumerate(self._band_keys(position)):
+            if key is not None:
+                self._bands[band].setdefault(key, []).append(position)
+
+
+def compute_signature(
+        hashes: typing.Iterable[int], size: int) -> typing.List[int]:
+    """Return one permutation hashing signature of hashed nodes."""
+    # Values of a bucket are smaller than step, borrowed values stay
+    # smaller than 2^64.
+    step = (HASH_MASK + 1) // size
+    result = [EMPTY] * size
+    for value in hashes:
+        bucket = value % size
+        value //= size
+        if value < result[bucket]:
+            result[bucket] = value
+    filled = [bucket for bucket in range(size) if result[bucket] != EMPTY]
+    if not filled:
+        return result
+    # Closest non-empty bucket to the right, the first one after the end.
+    source = filled[0] + size
+    for bucket in reversed(range(size)):
+        if result[bucket] != EMPTY:
+            source = bucket
+            continue
+        distance = source - bucket
+        result[bucket] = result[source % size] + distance * step
+    return result
+
+
+def estimate_jaccard(
+        left: typing.Sequence[int], right: typing.Sequence[int]) -> float:
+    if not left or left[0] == EMPTY or right[0] == EMPTY:
+        return 0
+    equal = sum(1 for a, b in zip(left, right) if a == b)
+    return equal / len(left)
+
+
+def _hash(node: int, seed: int) -> int:
+    """SplitMix64 finalizer, graph node IDs are consecutive."""
+    value = (node + (seed + 1) * 0x9E3779B97F4A7C15) & HASH_MASK
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & HASH_MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & HASH_MASK
+    return value ^ (value >> 31)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Cache of computed responses with size and time-to-live eviction.
+# Concurrent requests for the same key wait for a single computation.
+#
+
+import time
+import threading
+import collections
+import typing
+from concurrent.futures import Future
+
+HIT = "hit"
+MISS = "miss"
+# The value was computed by another request running at the same time.
+SHARED = "shared"
+
+
+class ResultCache:
+
+    def __init__(
+            self, capacity: int = 256, ttl: float = 600,
+            clock: typing.Callable[[], float] = time.monotonic):
+        self._capacity = capacity
+        self._ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        # Key -> (expiration time, value), oldest first.
+        self._values = collections.OrderedDict()
+        self._in_flight: typing.Dict[typing.Hashable, Future] = {}
+        self._counters = {HIT: 0, MISS: 0, SHARED: 0}
+
+    def get_or_compute(
+            self, key: typing.Hashable, compute: typing.Callable[[], any],
+            cacheable: typing.Callable[[any], bool] = None) \
+            -> typing.Tuple[any, str]:
+        """
+        Return value and HIT, MISS or SHARED. Values are not copied, they
+        must not be modified. Failed computations are not cached, neither
+        are values rejected by cacheable.
+        """
+        with self._lock:
+            now = self._clock()
+            if key in self._values:
+                expiration, value = self._values[key]
+                if expiration > now:
+                    self._values.move_to_end(key)
+                    self._counters[HIT] += 1
+                    return value, HIT
+                del self._values[key]
+            if key in self._in_flight:
+                future = self._in_flight[key]
+                self._counters[SHARED] += 1
+                owner = False
+            else:
+                future = Future()
+                self._in_flight[key] = future
+                self._counters[MISS] += 1
+                owner = True
+
+        if not owner:
+            return future.result(), SHARED
+
+        try:
+            value = compute()
+        except BaseException as error:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(error)
+            raise
+        with self._lock:
+            del self._in_flight[key]
+            if cacheable is None or cacheable(value):
+                self._values[key] = (self._clock() + self._ttl, value)
+                while len(self._values) > self._capacity:
+                    self._values.popitem(last=False)
+        future.set_result(value)
+        return value, MISS
+
+    def statistics(self) -> typing.Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self._counters[HIT],
+                "misses": self._counters[MISS],
+                "shared": self._counters[SHARED],
+                "size": len(self._values),
+                "capacity": self._capacity,
+            }
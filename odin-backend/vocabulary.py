@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Interning of Wikidata IDs. Datasets, hierarchy graphs and paths store
+# nodes as integers, node strings are needed only for the output.
+#
+# IDs are valid only in the process that created them, all datasets
+# and graphs used together must share the same vocabulary.
+#
+# The first IDs can be given by SharedValues, stored in a memory mapped
+# snapshot, so worker processes do not need their own copy of them.
+#
+
+import zlib
+import threading
+import typing
+
+
+class SharedValues:
+    """
+    Read-only values stored in buffers: utf-8 encoded values, offsets of
+    the values and a hash table used to find a value. The table has size
+    of a power of two, slots hold IDs or -1 for empty slots, collisions
+    use the next slot.
+    """
+
+    def __init__(
+            self, content: memoryview, offsets: typing.Sequence[int],
+            table: typing.Sequence[int]):
+        self._content = content
+        self._offsets = offsets
+        self._table = table
+
+    @staticmethod
+    def build_table(values: typing.List[bytes]) -> typing.List[int]:
+        """Return hash table of utf-8 encoded values."""
+        size = 1
+        # Keep at least half of the slots empty.
+        while size < 2 * len(values):
+            size *= 2
+        mask = size - 1
+        result = [-1] * size
+        for node, encoded in enumerate(values):
+            slot = zlib.crc32(encoded) & mask
+            while result[slot] != -1:
+                slot = (slot + 1) & mask
+            result[slot] = node
+        return result
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, node: int) -> str:
+        return bytes(self._encoded(node)).decode("utf-8")
+
+    def find(self, value: str) -> typing.Optional[int]:
+        """Return ID of the value, None if missing."""
+        encoded = value.encode("utf-8")
+        table = self._table
+        mask = len(table) - 1
+        slot = zlib.crc32(encoded) & mask
+        while table[slot] != -1:
+            if self._encoded(table[slot]) == encoded:
+                return table[slot]
+            slot = (slot + 1) & mask
+        return None
+
+    def _encoded(self, node: int) -> memoryview:
+        start = self._offsets[node]
+        return self._content[start:self._offsets[node + 1]]
+
+
+class Vocabulary:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ids: typing.Dict[str, int] = {}
+        self._values: typing.List[str] = []
+        self._shared: typing.Optional[SharedValues] = None
+        # IDs of values in _values start after the shared values.
+        self._shared_count = 0
+
+    def __len__(self):
+        return self._shared_count + len(self._values)
+
+    def __getitem__(self, node: int) -> str:
+        if node < self._shared_count:
+            return self._shared[node]
+        return self._values[node - self._shared_count]
+
+    def attach(self, shared: SharedValues):
+        """Use shared values as the first IDs, vocabulary must be empty."""
+        with self._lock:
+            if len(self) > 0:
+                raise ValueError("Vocabulary is not empty.")
+            self._shared = shared
+            self._shared_count = len(shared)
+
+    def intern(self, value: str) -> int:
+        result = self._ids.get(value)
+        if result is None and self._shared is not None:
+            # Shared values are not copied to _ids.
+            result = self._shared.find(value)
+        if result is None:
+            with self._lock:
+                result = self._ids.get(value)
+                if result is None:
+                    result = len(self)
+                    self._values.append(value)
+                    self._ids[value] = result
+        return result
+
+    def intern_all(self, values: typing.Iterable[str]) -> typing.List[int]:
+        return [self.intern(value) for value in values]
+
+    def decode(self, nodes: typing.Iterable[int]) -> typing.Tuple[str]:
+        if self._shared is not None:
+            return tuple(self[node] for node in nodes)
+        values = self._values
+        return tuple(values[node] for node in nodes)
+
+
+# Vocabulary used when none is given.
+default_vocabulary = Vocabulary()
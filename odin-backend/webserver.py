@@ -2,42 +2,741 @@
 # -*- coding: utf-8 -*-
 
 import os
+import gc
+import gzip
+import time
+import logging
+import hashlib
 
 import yaml
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, abort, \
+    stream_with_context
 
 from compute_graph_similarity import *
+from hierarchy_graph import load_hierarchy_graph
+from graph_snapshot import load_hierarchy_graph_with_snapshot
+from ancestor_closures import get_ancestor_closures
+from landmark_index import LandmarkIndex
+from dataset_index import DatasetIndex
+from minhash_index import MinHashIndex
+from dataset_store import DatasetStore
+from result_cache import ResultCache, MISS
+from worker_pool import WorkerPool, QueueFullError, WorkerCrashedError
+from metrics import Metrics, StageTimer
 
 app = Flask(__name__)
 
 configuration = {}
 
-path_filter_selectors = {
-    "closest": select_closest_for_each,
-    "distance": select_paths_by_length
-}
+# Graph shared by all requests, loaded at startup.
+hierarchy_graph = None
 
+# Index of the shared graph used by the landmark method.
+landmark_index = None
 
+# Index of datasets reaching each node, used to find similar datasets.
+dataset_index = None
+
+# MinHash signatures of dataset ancestor sets, used to find approximate
+# neighbours.
+minhash_index = None
+
+dataset_store = None
+
+result_cache = None
+
+# When set computations run in worker processes.
+worker_pool = None
+
+metrics = Metrics()
+
+
+# Datasets can be uploaded as files or given by IRI or file name:
+# curl -X POST -H "Content-Type: application/json"
+#  -d '{"collection": "v1", "datasets": ["000001", "000005"],
+#  "options": {"method": "closest"}}' localhost:8066/
 @app.route("/", methods=["POST"])
 def parse_request():
-    files = request.files.to_dict(flat=False)
-    [left, right] = [
-        load_dataset_from_json(json.load(file))
-        for file in files["dataset"]
+    start = time.perf_counter()
+    if request.is_json:
+        content = request.get_json()
+        collection = content.get(
+            "collection", configuration.get("pathServiceCollection"))
+        datasets = content["datasets"]
+        if not isinstance(datasets, list) or len(datasets) != 2 \
+                or not all(isinstance(item, str) for item in datasets):
+            abort(400, "Exactly two datasets are required.")
+        options = content.get("options", {})
+        try:
+            version = dataset_store.version(collection)
+        except KeyError as error:
+            abort(404, error.args[0])
+        source = ("collection", collection, datasets)
+        key = ("collection", collection, version, *datasets)
+    else:
+        files = request.files.to_dict(flat=False)
+        if len(files.get("dataset", [])) != 2:
+            abort(400, "Exactly two datasets are required.")
+        contents = [file.read() for file in files["dataset"]]
+        options = json.load(files["options"][0])
+        source = ("upload", contents)
+        key = ("upload", *[
+            hashlib.sha1(content).hexdigest() for content in contents
+        ])
+    # Streaming and paging options do not change the result, they are
+    # not cached.
+    stream = options.pop("stream", False)
+    paged = "limit" in options or "cursor" in options
+    limit = options.pop("limit", None)
+    if "cursor" in options and options.get("timeLimit") is not None:
+        # Partial results are not cached, next page could come from
+        # another result.
+        abort(400, "The cursor can not be used with timeLimit.")
+    cursor = options.pop("cursor", 0)
+    options = validate_options(options)
+    cursor, limit = validate_page(cursor, limit)
+    result = cached_compute_similarity(key, source, options)
+    if stream:
+        return Response(
+            stream_with_context(stream_similarity(
+                result, cursor, limit, start)),
+            mimetype="application/x-ndjson")
+    if paged:
+        result = select_page(result, cursor, limit)
+    serialize_start = time.perf_counter()
+    response = jsonify(result)
+    end = time.perf_counter()
+    metrics.record_request(
+        result["metadata"]["method"], end - start,
+        result["metadata"]["datasets"], {"serialize": end - serialize_start})
+    return response
+
+
+def validate_page(cursor, limit):
+    """Return cursor and limit as integers, abort for invalid values."""
+    try:
+        cursor = int(cursor)
+        limit = None if limit is None else int(limit)
+    except (TypeError, ValueError):
+        abort(400, "Invalid cursor or limit.")
+    if cursor < 0 or (limit is not None and limit < 1):
+        abort(400, "Invalid cursor or limit.")
+    return cursor, limit
+
+
+def select_page(result, cursor: int, limit: int):
+    """
+    Return result with at most limit paths starting at the cursor. The
+    metadata.nextCursor is given when there are more paths, the result
+    is cached so the following page does not repeat the search.
+    """
+    paths = result["paths"]
+    end = len(paths) if limit is None else min(cursor + limit, len(paths))
+    return {
+        **result,
+        "metadata": {
+            **result["metadata"],
+            "cursor": str(cursor),
+            "nextCursor": str(end) if end < len(paths) else None,
+        },
+        "paths": paths[cursor:end],
+    }
+
+
+def stream_similarity(result, cursor: int, limit: int, start: float):
+    """
+    Yield newline delimited JSON, the first line is the response without
+    paths, then one line for each path of the page, see select_page.
+    """
+    serialize_start = time.perf_counter()
+    try:
+        page = select_page(result, cursor, limit)
+        header = {
+            key: value for key, value in page.items() if key != "paths"
+        }
+        yield json.dumps(header) + "\n"
+        for path in page["paths"]:
+            yield json.dumps(path) + "\n"
+    finally:
+        end_time = time.perf_counter()
+        metrics.record_request(
+            result["metadata"]["method"], end_time - start,
+            result["metadata"]["datasets"],
+            {"serialize": end_time - serialize_start})
+
+
+def validate_options(options):
+    """
+    Return options with the configured engine and the default method
+    unless given, so equal requests have equal options.
+    """
+    options = {
+        "engine": configuration.get("pathServiceEngine", "multi-source"),
+        "method": "closest",
+        **options,
+    }
+    method = options["method"]
+    if method not in path_filter_selectors:
+        abort(400, "Unknown method: {}".format(method))
+    try:
+        create_search_options(options)
+    except ValueError as error:
+        abort(400, error.args[0])
+    return options
+
+
+class UnknownDatasetError(Exception):
+    """Unknown collection or dataset, the argument is the message."""
+
+
+def load_datasets(source):
+    """Raise KeyError for unknown collection or dataset."""
+    if source[0] == "collection":
+        _, collection, datasets = source
+        return [dataset_store.get(collection, dataset) for dataset in datasets]
+    return [
+        load_dataset_from_json(json.loads(content))
+        for content in source[1]
     ]
-    options = json.load(files["options"][0])
-    return jsonify(compute_similarity(left, right, options))
 
 
-def compute_similarity(left, right, options):
-    all_paths = find_all_path(left, right)
+def compute_similarity_for_source(source, options):
+    timer = StageTimer()
+    with timer.stage("load"):
+        try:
+            [left, right] = load_datasets(source)
+        except KeyError as error:
+            # Other KeyErrors are errors of the computation.
+            raise UnknownDatasetError(error.args[0])
+    return compute_similarity(
+        left, right, options, timer, shared_graph_for_source(source))
+
+
+def shared_graph_for_source(source):
+    """
+    The shared graph is used only for datasets loaded from its collection,
+    uploaded datasets have their own mappings and hierarchy even when they
+    use IRI of a dataset in the collection.
+    """
+    if source[0] == "collection" \
+            and source[1] == configuration.get("pathServiceCollection"):
+        return hierarchy_graph
+    return None
+
+
+def shared_hub_degrees():
+    """In degrees of the shared graph by vocabulary ID, None without it."""
+    if hierarchy_graph is None:
+        return None
+    return hierarchy_graph.entity_in_degrees()
+
+
+def cached_compute_similarity(datasets_key, source, options):
+    """
+    Datasets are loaded only when the result is not in the cache. Cache
+    status is added to the metadata, statistics are removed unless
+    requested by the options.
+    """
+
+    def compute():
+        try:
+            return run_task(compute_similarity_for_source, source, options)
+        except UnknownDatasetError as error:
+            abort(404, error.args[0])
+
+    def complete(result):
+        # Partial results of the timeLimit option are not cached.
+        return not result["metadata"].get("partial", False)
+
+    # Statistics are kept in the cached result, the option only selects
+    # the output.
+    key = (datasets_key, json.dumps({
+        name: value for name, value in options.items()
+        if name != "statistics"
+    }, sort_keys=True))
+    result, status = result_cache.get_or_compute(key, compute, complete)
+    metadata = {**result["metadata"], "cache": status}
+    statistics = metadata.pop("statistics")
+    if status == MISS:
+        metrics.record_computation(metadata["method"], statistics)
+    if options.get("statistics", False):
+        metadata["statistics"] = statistics
+    return {**result, "metadata": metadata}
+
+
+@app.route("/status", methods=["GET"])
+def get_status():
+    return jsonify({
+        "collection": configuration.get("pathServiceCollection"),
+        "datasetCache": dataset_store.statistics(),
+        "resultCache": result_cache.statistics(),
+        "workerPool":
+            None if worker_pool is None else worker_pool.statistics(),
+        "ancestorClosures":
+            None if hierarchy_graph is None
+            else get_ancestor_closures(hierarchy_graph).statistics(),
+        "landmarkIndex":
+            None if landmark_index is None else landmark_index.statistics(),
+        "datasetIndex":
+            None if dataset_index is None else dataset_index.statistics(),
+        "minHashIndex":
+            None if minhash_index is None else minhash_index.statistics(),
+    })
+
+
+def run_task(function, *args):
+    """Run function in a worker process if the pool is used."""
+    if worker_pool is None:
+        return function(*args)
+    try:
+        return worker_pool.run(function, *args)
+    except QueueFullError:
+        abort(503, "Too many requests, try again later.")
+    except WorkerCrashedError:
+        logging.error("Worker process died, workers were restarted.")
+        abort(503, "Worker process failed, try again later.")
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return jsonify(metrics.to_json())
+
+
+def compute_similarity(
+        left, right, options, timer: StageTimer = None, shared_graph=None):
+    """
+    Durations and counts are stored in metadata.statistics . The shared
+    graph must be the graph of the collection the datasets were loaded
+    from.
+    """
+    if timer is None:
+        timer = StageTimer()
+    with timer.stage("graph"):
+        graph, left_entries, right_entries = \
+            prepare_graph(left, right, shared_graph)
+    entries = (left_entries, right_entries)
     method = options.get("method", "closest")
-    selected_paths = path_filter_selectors[method](all_paths, options)
-    return paths_to_output(selected_paths, [left, right], {
-        "method": method,
-        "totalPathCount": len(all_paths),
-        "resultPathCount": len(selected_paths)
+    if method == "landmark" and landmark_index is not None \
+            and graph is hierarchy_graph:
+        return estimate_similarity(
+            graph, left, right, entries, options, timer)
+    # Hubs are the same for the shared and per-request graphs.
+    search_options = create_search_options(options, shared_hub_degrees())
+    with timer.stage("search"):
+        search = search_graph_paths(
+            graph, left_entries, right_entries, search_options)
+    if search_options.summary_only:
+        return summarize_similarity(
+            graph, left, right, entries, options, search, timer)
+    all_paths = search.paths
+    with timer.stage("select"):
+        selected_paths = select_paths(all_paths, options)
+    timer.counts.update({
+        "leftEntities": len(left_entries),
+        "rightEntities": len(right_entries),
+        "edges": graph.edge_count(),
+        "pathsFound": len(all_paths),
+        "pathsSelected": len(selected_paths),
+    })
+    with timer.stage("output"):
+        result = paths_to_output(selected_paths, [left, right], {
+            "method": method,
+            "totalPathCount": len(all_paths),
+            "resultPathCount": len(selected_paths),
+            "truncated": search.truncated,
+        }, options.get("format") == "compact")
+    add_cut_hubs(result["metadata"], options, search.cut_hubs)
+    add_coverage(
+        result["metadata"], options, search,
+        len(left_entries) * len(right_entries))
+    result["metadata"]["statistics"] = timer.to_json()
+    return result
+
+
+def add_coverage(metadata, options, search: PathSearchResult, pairs: int):
+    """Report whether the search was stopped by the timeLimit option."""
+    if options.get("timeLimit") is None:
+        return
+    metadata["partial"] = search.partial
+    if search.partial:
+        # Engines searching pairs report pairs instead of levels.
+        if search.searched_pairs is None:
+            searched = {"searchedLevels": search.searched_levels}
+        else:
+            searched = {"searchedPairs": search.searched_pairs}
+        metadata["coverage"] = {
+            **searched,
+            "connectedPairs": len({
+                (path.nodes[0], path.nodes[-1]) for path in search.paths
+            }),
+            "pairs": pairs,
+        }
+
+
+def add_cut_hubs(metadata, options, cut_hubs):
+    """Report nodes not entered because of the maxHubDegree option."""
+    if options.get("maxHubDegree") is not None:
+        metadata["cutHubs"] = sorted(default_vocabulary.decode(cut_hubs))
+
+
+def summarize_similarity(
+        graph, left, right, entries, options, search: PathSearchResult,
+        timer: StageTimer):
+    """
+    Response of the summaryOnly option, there are no paths. Entries are
+    graph node IDs of the left and the right entities.
+    """
+    left_entries, right_entries = entries
+    with timer.stage("select"):
+        lengths = select_lengths(search.path_lengths, options)
+    timer.counts.update({
+        "leftEntities": len(left_entries),
+        "rightEntities": len(right_entries),
+        "edges": graph.edge_count(),
+        "pathsFound": len(search.path_lengths),
+        "pathsSelected": len(lengths),
+    })
+    result = paths_to_output([], [left, right], {
+        "method": options.get("method", "closest"),
+        "totalPathCount": len(search.path_lengths),
+        "resultPathCount": len(lengths),
+        "truncated": search.truncated,
+    })
+    result["similarity"] = lengths_to_similarity(lengths)
+    add_cut_hubs(result["metadata"], options, search.cut_hubs)
+    add_coverage(
+        result["metadata"], options, search,
+        len(left_entries) * len(right_entries))
+    result["metadata"]["statistics"] = timer.to_json()
+    return result
+
+
+def estimate_similarity(
+        graph, left, right, entries, options, timer: StageTimer):
+    """Similarity summary of the landmark method, there are no paths."""
+    left_entries, right_entries = entries
+    with timer.stage("estimate"):
+        estimate = estimate_closest(
+            graph, landmark_index, left_entries, right_entries, options)
+    timer.counts.update({
+        "leftEntities": len(left_entries),
+        "rightEntities": len(right_entries),
+        **estimate.counts(),
     })
+    result = paths_to_output([], [left, right], {
+        "method": "landmark",
+        "estimate": estimate.counts(),
+    }, options.get("format") == "compact")
+    add_cut_hubs(
+        result["metadata"], options, graph.decode(estimate.cut_hubs))
+    if options.get("timeLimit") is not None:
+        result["metadata"]["partial"] = estimate.partial
+    result["similarity"] = estimate.similarity
+    result["metadata"]["statistics"] = timer.to_json()
+    return result
+
+
+# Values of the similarity summary the ranking can be ordered by.
+RANK_BY = ["min", "average", "max", "sum"]
+
+
+# Candidates are "all", "neighbours" for approximate neighbours of the
+# query or a list of datasets.
+# curl -X POST -H "Content-Type: application/json"
+#  -d '{"query": "<iri>", "candidates": "all", "options": {"distance": 3}}'
+#  localhost:8066/rank
+@app.route("/rank", methods=["POST"])
+def parse_rank_request():
+    start = time.perf_counter()
+    content = request.get_json()
+    if hierarchy_graph is None:
+        abort(503, "Mapping collection is not loaded.")
+    query = content["query"]
+    candidates = content.get("candidates", "all")
+    if candidates not in ["all", "neighbours"] and (
+            not isinstance(candidates, list)
+            or not all(isinstance(item, str) for item in candidates)):
+        abort(400, "Candidates must be a list of datasets, "
+                   "\"all\" or \"neighbours\".")
+    if candidates == "all":
+        candidates = [
+            candidate for candidate in hierarchy_graph.datasets.keys()
+            if candidate != query
+        ]
+    elif candidates == "neighbours":
+        if minhash_index is None:
+            abort(503, "MinHash index is not available.")
+        if query not in hierarchy_graph.datasets:
+            abort(404, "Unknown dataset: " + query)
+        candidates = [
+            item.dataset for item in minhash_index.neighbours(query)
+        ]
+    for dataset in [query, *candidates]:
+        if dataset not in hierarchy_graph.datasets:
+            abort(404, "Unknown dataset: " + dataset)
+    options = validate_options(content.get("options", {}))
+    if options.get("rankBy", "average") not in RANK_BY:
+        abort(400, "Invalid rankBy: {}".format(options["rankBy"]))
+    result = run_task(rank_similarity, query, candidates, options)
+    serialize_start = time.perf_counter()
+    response = jsonify(result)
+    end = time.perf_counter()
+    metrics.record_request(
+        "rank-" + result["metadata"]["method"], end - start,
+        [query], {"serialize": end - serialize_start})
+    return response
+
+
+def rank_similarity(query, candidates, options):
+    """
+    Rank candidates by similarity summary of selected paths, datasets without
+    paths are at the end.
+    """
+    method = options.get("method", "closest")
+    rank_by = options.get("rankBy", "average")
+    if method == "landmark" and landmark_index is not None:
+        ranking, cut_hubs, partial = estimate_ranking(
+            query, candidates, options)
+        truncated = False
+    else:
+        # Only the similarity summary is needed, unless all shortest
+        # paths are counted.
+        summary_options = {
+            "summaryOnly": not options.get("allShortestPaths", False),
+            **options,
+        }
+        search_options = create_search_options(summary_options)
+        searches = search_paths_one_to_many(
+            hierarchy_graph, query, candidates, search_options)
+        ranking = []
+        for candidate, search in searches.items():
+            if search_options.summary_only:
+                path_count = len(search.path_lengths)
+                lengths = select_lengths(search.path_lengths, options)
+                selected_count = len(lengths)
+                similarity = lengths_to_similarity(lengths)
+            else:
+                path_count = len(search.paths)
+                selected_paths = select_paths(search.paths, options)
+                selected_count = len(selected_paths)
+                similarity = paths_to_similarity(selected_paths)
+            ranking.append({
+                "dataset": candidate,
+                "similarity": similarity,
+                "totalPathCount": path_count,
+                "resultPathCount": selected_count,
+            })
+        truncated = any(search.truncated for search in searches.values())
+        partial = any(search.partial for search in searches.values())
+        cut_hubs = set()
+        for search in searches.values():
+            cut_hubs.update(hierarchy_graph.decode(search.cut_hubs))
+    ranking.sort(key=lambda item: (
+        rank_by not in item["similarity"],
+        item["similarity"].get(rank_by, 0),
+        item["dataset"]))
+    metadata = {
+        "method": method,
+        "rankBy": rank_by,
+        "query": query,
+        "truncated": truncated,
+    }
+    add_cut_hubs(metadata, options, cut_hubs)
+    if options.get("timeLimit") is not None:
+        metadata["partial"] = partial
+    return {
+        "metadata": metadata,
+        "candidates": ranking,
+    }
+
+
+def estimate_ranking(query, candidates, options):
+    """
+    Return ranking, nodes cut by the exact search and true if the search
+    was stopped by the deadline. All candidates are searched at once.
+    """
+    estimates = estimate_closest_one_to_many(
+        hierarchy_graph, landmark_index, query, candidates, options,
+        create_search_options(options))
+    ranking = []
+    cut_hubs = set()
+    partial = False
+    for candidate in candidates:
+        estimate = estimates[candidate]
+        ranking.append({
+            "dataset": candidate,
+            "similarity": estimate.similarity,
+            "estimate": estimate.counts(),
+        })
+        cut_hubs.update(hierarchy_graph.decode(estimate.cut_hubs))
+        partial |= estimate.partial
+    return ranking, cut_hubs, partial
+
+
+# Number of similar datasets returned unless given by options["limit"].
+SIMILAR_DATASETS_LIMIT = 10
+
+
+# curl -X POST -H "Content-Type: application/json"
+#  -d '{"query": "<iri>", "options": {"limit": 10, "distance": 3}}'
+#  localhost:8066/similar
+@app.route("/similar", methods=["POST"])
+def parse_similar_request():
+    start = time.perf_counter()
+    content = request.get_json()
+    if dataset_index is None:
+        abort(503, "Dataset index is not available.")
+    query = content["query"]
+    if query not in hierarchy_graph.datasets:
+        abort(404, "Unknown dataset: " + query)
+    options = content.get("options", {})
+    for name in ["limit", "distance"]:
+        value = options.get(name)
+        if value is not None and (not isinstance(value, int) or value < 0):
+            abort(400, "Invalid {}: {}".format(name, value))
+    result = run_task(similar_datasets, query, options)
+    metrics.record_request("similar", time.perf_counter() - start, [query])
+    return jsonify(result)
+
+
+def similar_datasets(query, options):
+    """Datasets with the highest score of the dataset index."""
+    similar = dataset_index.search(
+        hierarchy_graph, query, options.get("limit", SIMILAR_DATASETS_LIMIT),
+        options.get("distance"))
+    return {
+        "metadata": {
+            "query": query,
+            "maxDistance": min(
+                options.get("distance", dataset_index.max_distance),
+                dataset_index.max_distance),
+        },
+        "candidates": [
+            {
+                "dataset": item.dataset,
+                "score": item.score,
+                "sharedNodes": item.shared_nodes,
+            } for item in similar
+        ],
+    }
+
+
+# curl -X POST -H "Content-Type: application/json"
+#  -d '{"query": "<iri>", "options": {"limit": 10, "minSimilarity": 0.5}}'
+#  localhost:8066/neighbours
+@app.route("/neighbours", methods=["POST"])
+def parse_neighbours_request():
+    start = time.perf_counter()
+    content = request.get_json()
+    if minhash_index is None:
+        abort(503, "MinHash index is not available.")
+    query = content["query"]
+    if query not in hierarchy_graph.datasets:
+        abort(404, "Unknown dataset: " + query)
+    options = content.get("options", {})
+    limit = options.get("limit", SIMILAR_DATASETS_LIMIT)
+    if not isinstance(limit, int) or limit < 0:
+        abort(400, "Invalid limit: {}".format(limit))
+    min_similarity = options.get("minSimilarity", 0)
+    if not isinstance(min_similarity, (int, float)) \
+            or not 0 <= min_similarity <= 1:
+        abort(400, "Invalid minSimilarity: {}".format(min_similarity))
+    result = run_task(approximate_neighbours, query, limit, min_similarity)
+    metrics.record_request(
+        "neighbours", time.perf_counter() - start, [query])
+    return jsonify(result)
+
+
+def approximate_neighbours(query, limit, min_similarity):
+    """Datasets with similar ancestor sets, found by the MinHash index."""
+    neighbours = minhash_index.neighbours(query, limit, min_similarity)
+    return {
+        "metadata": {
+            "query": query,
+            "signatureSize": minhash_index.size,
+            "bands": minhash_index.band_count,
+        },
+        "candidates": [
+            {
+                "dataset": item.dataset,
+                "similarity": item.similarity,
+            } for item in neighbours
+        ],
+    }
+
+
+# Number of common ancestors returned unless given by options["limit"].
+COMMON_ANCESTORS_LIMIT = 20
+
+
+# curl -X POST -H "Content-Type: application/json"
+#  -d '{"datasets": ["<iri>", "<iri>", "<iri>"], "options": {"distance": 3}}'
+#  localhost:8066/common
+@app.route("/common", methods=["POST"])
+def parse_common_request():
+    start = time.perf_counter()
+    content = request.get_json()
+    if hierarchy_graph is None:
+        abort(503, "Mapping collection is not loaded.")
+    datasets = content["datasets"]
+    if len(datasets) < 2:
+        abort(400, "At least two datasets are required.")
+    for dataset in datasets:
+        if dataset not in hierarchy_graph.datasets:
+            abort(404, "Unknown dataset: " + dataset)
+    options = validate_options(content.get("options", {}))
+    for name in ["minDatasets", "limit"]:
+        value = options.get(name)
+        if value is not None and (not isinstance(value, int) or value < 1):
+            abort(400, "Invalid {}: {}".format(name, value))
+    result = run_task(common_ancestors, datasets, options)
+    serialize_start = time.perf_counter()
+    response = jsonify(result)
+    end = time.perf_counter()
+    metrics.record_request(
+        "common", end - start, datasets,
+        {"serialize": end - serialize_start})
+    return response
+
+
+def common_ancestors(datasets, options):
+    """Nodes shared by all or options["minDatasets"] of the datasets."""
+    search_options = create_search_options(options)
+    # Distance limits each dataset, not a path between two datasets.
+    search_options.max_level = options.get("distance")
+    limit = options.get("limit", COMMON_ANCESTORS_LIMIT)
+    result = find_common_ancestors(
+        hierarchy_graph, datasets, options.get("minDatasets"),
+        search_options, limit)
+    metadata = {"minDatasets": options.get("minDatasets", len(datasets))}
+    if options.get("timeLimit") is not None:
+        metadata["partial"] = result.partial
+        if result.partial:
+            metadata["coverage"] = {"searchedLevels": result.searched_levels}
+    add_cut_hubs(
+        metadata, options, hierarchy_graph.decode(result.cut_hubs))
+    return common_ancestors_to_output(
+        result, hierarchy_graph, datasets, metadata)
+
+
+# Smaller responses are not worth compressing.
+GZIP_MIN_SIZE = 1024
+
+
+@app.after_request
+def compress_response(response):
+    if "gzip" not in request.accept_encodings \
+            or response.direct_passthrough \
+            or response.mimetype != "application/json" \
+            or "Content-Encoding" in response.headers:
+        return response
+    content = response.get_data()
+    if len(content) < GZIP_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(content, compresslevel=5))
+    response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
 
 
 def load_configuration():
@@ -45,6 +744,130 @@ def load_configuration():
         return yaml.load(file, Loader=yaml.FullLoader)["configuration"]
 
 
+def data_directory():
+    return os.path.join("..", configuration["data"])
+
+
+def load_shared_graph():
+    """Load hierarchy of the configured mapping collection if available."""
+    collection = configuration.get("pathServiceCollection")
+    if collection is None:
+        return None
+    directory = os.path.join(data_directory(), "mapping", collection)
+    if not os.path.isdir(directory):
+        logging.warning("Missing mapping collection: %s", directory)
+        return None
+    logging.info("Loading hierarchy graph from %s ...", directory)
+    snapshot = configuration.get("pathServiceSnapshot")
+    if snapshot is None:
+        graph = load_hierarchy_graph(directory)
+    else:
+        graph = load_hierarchy_graph_with_snapshot(
+            directory, os.path.join(data_directory(), snapshot))
+    logging.info(
+        "Loading hierarchy graph ... done, nodes: %i edges: %i datasets: %i",
+        len(graph), graph.edge_count(), len(graph.datasets))
+    # Degree tables used by the maxHubDegree option.
+    graph.entity_in_degrees()
+    if configuration.get("pathServiceEngine") == "closure":
+        logging.info("Computing ancestor closures ...")
+        closures = get_ancestor_closures(graph)
+        closures.compute_datasets()
+        logging.info(
+            "Computing ancestor closures ... done, %s",
+            closures.statistics())
+    return graph
+
+
+def load_landmark_index(graph):
+    landmark_count = configuration.get("pathServiceLandmarks", 0)
+    if graph is None or landmark_count == 0:
+        return None
+    logging.info("Building landmark index ...")
+    index = LandmarkIndex.build(graph, landmark_count)
+    logging.info("Building landmark index ... done")
+    return index
+
+
+def load_dataset_index(graph):
+    max_distance = configuration.get("pathServiceDatasetIndexDistance", 0)
+    if graph is None or max_distance == 0:
+        return None
+    logging.info("Building dataset index ...")
+    index = DatasetIndex.build(graph, max_distance)
+    logging.info("Building dataset index ... done, %s", index.statistics())
+    return index
+
+
+def load_minhash_index(graph):
+    size = configuration.get("pathServiceMinHashSize", 0)
+    if graph is None or size == 0:
+        return None
+    logging.info("Building MinHash index ...")
+    index = MinHashIndex.build(
+        graph, size, configuration.get("pathServiceMinHashBands", 32))
+    logging.info("Building MinHash index ... done, %s", index.statistics())
+    return index
+
+
+def initialize(new_configuration):
+    """
+    Load data shared by all requests, create the result cache and start
+    worker processes.
+    """
+    global result_cache, worker_pool
+    initialize_data(new_configuration)
+    result_cache = ResultCache(
+        configuration.get("pathServiceResultCacheSize", 256),
+        configuration.get("pathServiceResultCacheTtl", 600))
+    if configuration.get("pathServiceWorkers", 0) > 0:
+        logging.info(
+            "Starting %i worker processes ...",
+            configuration["pathServiceWorkers"])
+        # Forked workers share the loaded data until they write to it, the
+        # garbage collector would otherwise touch all objects.
+        gc.freeze()
+        worker_pool = WorkerPool(
+            configuration["pathServiceWorkers"],
+            configuration.get("pathServiceQueueSize", 16),
+            initialize_worker, (configuration,))
+
+
+def initialize_data(new_configuration):
+    """Load data shared by all requests."""
+    global configuration, hierarchy_graph, landmark_index, dataset_index, \
+        minhash_index, dataset_store
+    configuration = new_configuration
+    hierarchy_graph = load_shared_graph()
+    landmark_index = load_landmark_index(hierarchy_graph)
+    dataset_index = load_dataset_index(hierarchy_graph)
+    minhash_index = load_minhash_index(hierarchy_graph)
+    dataset_store = DatasetStore(
+        data_directory(), configuration.get("pathServiceDatasetCacheSize", 128))
+
+
+def initialize_worker(worker_configuration):
+    """
+    Forked workers already have the data of the main process, arrays of
+    the snapshot are shared by all processes through the page cache.
+    """
+    if dataset_store is None:
+        initialize_data(worker_configuration)
+
+
+def create_app():
+    """
+    Return the initialized application for a WSGI server, the server
+    should use one process with threads, for example:
+      gunicorn --workers 1 --threads 8 "webserver:create_app()"
+    Computations run in the pathServiceWorkers processes.
+    """
+    initialize(load_configuration())
+    return app
+
+
 if __name__ == "__main__":
-    configuration = load_configuration()
-    app.run(port=configuration["pathServicePort"])
+    logging.basicConfig(level=logging.INFO)
+    initialize(load_configuration())
+    # Development server, see create_app for production.
+    app.run(port=configuration["pathServicePort"], threaded=True)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# Pool of worker processes used to run CPU heavy computations outside of
+# the web server process. The number of waiting tasks is bounded, when
+# the queue is full new tasks are rejected.
+#
+# Workers are forked, so they share data loaded by the server process.
+# When a worker dies the executor is broken for good, so we replace it
+# and report the failed tasks with WorkerCrashedError.
+#
+
+import threading
+import multiprocessing
+import typing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class WorkerCrashedError(Exception):
+    pass
+
+
+class WorkerPool:
+
+    def __init__(
+            self, process_count: int, queue_size: int,
+            initializer: typing.Callable = None, initargs: typing.Tuple = ()):
+        self._process_count = process_count
+        self._queue_size = queue_size
+        self._initializer = initializer
+        self._initargs = initargs
+        # Start the workers now, not from a request thread.
+        self._executor = self._create_executor()
+        # Running and waiting tasks.
+        self._slots = threading.BoundedSemaphore(process_count + queue_size)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._rejected = 0
+        self._restarts = 0
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        executor = ProcessPoolExecutor(
+            self._process_count,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=self._initializer, initargs=self._initargs)
+        executor.submit(int).result()
+        return executor
+
+    def run(self, function: typing.Callable, *args):
+        """
+        Run function in a worker and wait for the result. Raise
+        WorkerCrashedError when a worker died, the workers are restarted.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise QueueFullError()
+        with self._lock:
+            self._active += 1
+            executor = self._executor
+        try:
+            future = executor.submit(function, *args)
+        except BrokenProcessPool:
+            self._release()
+            self._replace(executor)
+            raise WorkerCrashedError()
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            self._replace(executor)
+            raise WorkerCrashedError()
+
+    def _replace(self, broken: ProcessPoolExecutor):
+        """Replace the broken executor unless another task did so."""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = self._create_executor()
+            self._restarts += 1
+        broken.shutdown(wait=False)
+
+    def _release(self):
+        with self._lock:
+            self._active -= 1
+        self._slots.release()
+
+    def statistics(self) -> typing.Dict[str, int]:
+        with self._lock:
+            return {
+                "workers": self._process_count,
+                "queueSize": self._queue_size,
+                "active": self._active,
+                "rejected": self._rejected,
+                "restarts": self._restarts,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown()